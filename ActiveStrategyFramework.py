@@ -4,10 +4,151 @@ import math
 import UNI_v3_funcs
 import copy
 
+########################################################
+# Base class for strategies run by the framework
+# A strategy must implement:
+#   set_liquidity_ranges(current_strat_obs) -> list of range dicts, strategy_info dict
+#   check_reset_batch(prices,strategy_state) -> dict of reset_reason : boolean mask
+# check_reset_batch works on arrays of prices and on strategy_state, a dict holding the
+# strategy_info values and the per range 'token_0'/'token_1' amounts (last axis = range),
+# all of which may be scalars or arrays broadcastable against prices. When prices is an
+# array of swap prices the amounts are those held at each price (shape prices x ranges).
+# Reasons are checked in the order they are returned, the first one that is set is recorded.
+# Ranges are named by RANGE_NAMES in the output columns, any number of ranges is allowed.
+########################################################
+
+class Strategy:
+    
+    RANGE_NAMES = ('base',)
+    
+    def set_liquidity_ranges(self,current_strat_obs):
+        raise NotImplementedError
+    
+    # Optional array version of set_liquidity_ranges over many paths at once (MonteCarlo.ObservationBatch),
+    # range and strategy_info values are arrays with one entry per path
+    def set_liquidity_ranges_batch(self,batch_obs):
+        raise NotImplementedError
+    
+    def check_reset_batch(self,prices,strategy_state):
+        return dict()
+    
+    #####################################
+    # Combined reset mask over all reasons
+    #####################################
+    
+    def reset_mask(self,prices,strategy_state):
+        mask = np.zeros(np.shape(prices),dtype=bool)
+        for reason_mask in self.check_reset_batch(prices,strategy_state).values():
+            mask = mask | reason_mask
+        return mask
+    
+    #####################################
+    # State of an observation in the form used by check_reset_batch
+    # With prices, the amounts are evaluated at each of those prices instead of the observation's
+    #####################################
+    
+    def strategy_state(self,current_strat_obs,strategy_info,prices=None):
+        strategy_state            = dict(strategy_info)
+        if prices is None:
+            strategy_state['token_0'] = np.array([x['token_0'] for x in current_strat_obs.liquidity_ranges])
+            strategy_state['token_1'] = np.array([x['token_1'] for x in current_strat_obs.liquidity_ranges])
+        else:
+            ticks                     = price_to_tick(prices,current_strat_obs.decimals_0,current_strat_obs.decimals_1,current_strat_obs.tickSpacing)
+            strategy_state['token_0'],strategy_state['token_1'] = UNI_v3_funcs.get_amounts_array(
+                                          np.reshape(ticks,(-1,1)),
+                                          np.array([x['lower_bin_tick'] for x in current_strat_obs.liquidity_ranges],dtype=float),
+                                          np.array([x['upper_bin_tick'] for x in current_strat_obs.liquidity_ranges],dtype=float),
+                                          np.array([x['position_liquidity'] for x in current_strat_obs.liquidity_ranges],dtype=float),
+                                          current_strat_obs.decimals_0,current_strat_obs.decimals_1)
+        return strategy_state
+    
+    #####################################
+    # Check if a rebalance is necessary. 
+    # If it is, remove the liquidity and set new ranges
+    #####################################
+    
+    def check_strategy(self,current_strat_obs,strategy_info):
+        
+        reset_masks = self.check_reset_batch(current_strat_obs.price,self.strategy_state(current_strat_obs,strategy_info))
+        
+        for reset_reason,reason_mask in reset_masks.items():
+            if reason_mask:
+                current_strat_obs.reset_point  = True
+                current_strat_obs.reset_reason = reset_reason
+                
+                # Remove liquidity and claim fees 
+                current_strat_obs.remove_liquidity()
+                
+                # Reset liquidity
+                return self.set_liquidity_ranges(current_strat_obs)
+            
+        return current_strat_obs.liquidity_ranges,strategy_info
+    
+    def range_name(self,i):
+        return self.RANGE_NAMES[i] if i < len(self.RANGE_NAMES) else 'range_'+str(i)
+    
+    ########################################################
+    # Extract strategy parameters
+    ########################################################
+    def dict_components(self,strategy_observation):
+            this_data = dict()
+            
+            # General variables
+            this_data['time']                   = strategy_observation.time
+            this_data['price']                  = strategy_observation.price
+            this_data['price_1_0']              = 1/this_data['price']
+            this_data['reset_point']            = strategy_observation.reset_point
+            this_data['reset_reason']           = strategy_observation.reset_reason
+            
+            # Range Variables
+            for i in range(len(strategy_observation.liquidity_ranges)):
+                this_data[self.range_name(i)+'_range_lower'] = strategy_observation.liquidity_ranges[i]['lower_bin_price']
+                this_data[self.range_name(i)+'_range_upper'] = strategy_observation.liquidity_ranges[i]['upper_bin_price']
+            
+            # Strategy specific variables (e.g. reset ranges)
+            this_data.update(strategy_observation.strategy_info)
+            
+            # Fee Varaibles
+            this_data['token_0_fees']           = strategy_observation.token_0_fees 
+            this_data['token_1_fees']           = strategy_observation.token_1_fees 
+            this_data['token_0_fees_accum']     = strategy_observation.token_0_fees_accum
+            this_data['token_1_fees_accum']     = strategy_observation.token_1_fees_accum
+            
+            # Execution cost variables (token 0)
+            this_data['gas_cost']               = strategy_observation.gas_cost
+            this_data['swap_cost']              = strategy_observation.swap_cost
+            
+            # Asset Variables
+            this_data['token_0_left_over']      = strategy_observation.token_0_left_over
+            this_data['token_1_left_over']      = strategy_observation.token_1_left_over
+            
+            total_token_0 = 0.0
+            total_token_1 = 0.0
+            for i in range(len(strategy_observation.liquidity_ranges)):
+                total_token_0 += strategy_observation.liquidity_ranges[i]['token_0']
+                total_token_1 += strategy_observation.liquidity_ranges[i]['token_1']
+                
+            this_data['token_0_allocated']      = total_token_0
+            this_data['token_1_allocated']      = total_token_1
+            this_data['token_0_total']          = total_token_0 + strategy_observation.token_0_left_over + strategy_observation.token_0_fees_accum
+            this_data['token_1_total']          = total_token_1 + strategy_observation.token_1_left_over + strategy_observation.token_1_fees_accum
+
+            # Value Variables
+            this_data['value_position']         = this_data['token_0_total'] + this_data['token_1_total'] * this_data['price_1_0']
+            this_data['value_allocated']        = this_data['token_0_allocated'] + this_data['token_1_allocated'] * this_data['price_1_0']
+            this_data['value_left_over']        = this_data['token_0_left_over'] + this_data['token_1_left_over'] * this_data['price_1_0']
+            
+            for i in range(len(strategy_observation.liquidity_ranges)):
+                this_data[self.range_name(i)+'_position_value'] = strategy_observation.liquidity_ranges[i]['token_0'] + \
+                                                                  strategy_observation.liquidity_ranges[i]['token_1'] * this_data['price_1_0']
+             
+            return this_data
+
 class StrategyObservation:
     def __init__(self,timepoint,current_price,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,
                  decimals_0,decimals_1,token_0_left_over=0.0,token_1_left_over=0.0,
-                 token_0_fees=0.0,token_1_fees=0.0,liquidity_ranges=None,strategy_info = None,swaps=None):
+                 token_0_fees=0.0,token_1_fees=0.0,liquidity_ranges=None,strategy_info = None,swaps=None,
+                 fee_mode='approximate',cost_model=None,virtual_liquidity=None):
         
         ######################################
         # 1. Store current values
@@ -30,6 +171,14 @@ class StrategyObservation:
         self.tickSpacing           = int(self.fee_tier*2*10000)   
         self.token_0_fees          = 0.0
         self.token_1_fees          = 0.0
+        self.fee_mode              = fee_mode
+        self.cost_model            = cost_model
+        self.gas_cost              = 0.0
+        self.swap_cost             = 0.0
+        self.virtual_liquidity     = virtual_liquidity
+        
+        if swaps is not None and len(swaps) > 0:
+            self.virtual_liquidity = float(swaps['virtual_liquidity'].iloc[-1])
         
         
         TICK_P_PRE                 = int(math.log(self.decimal_adjustment*self.price,1.0001))        
@@ -61,38 +210,94 @@ class StrategyObservation:
                 self.liquidity_ranges[i]['token_0'] = amount_0
                 self.liquidity_ranges[i]['token_1'] = amount_1
                 
-                if swaps is not None:
-                    fees_token_0,fees_token_1           = self.accrue_fees(swaps)
-                    self.token_0_fees                   = fees_token_0
-                    self.token_1_fees                   = fees_token_1
+            # Fees of the period, accrue_fees covers every range
+            if swaps is not None:
+                fees_token_0,fees_token_1           = self.accrue_fees(swaps)
+                self.token_0_fees                   = fees_token_0
+                self.token_1_fees                   = fees_token_1
                 
             self.liquidity_ranges,self.strategy_info     = strategy_in.check_strategy(self,strategy_info)
                 
     ########################################################
     # Accrue earned fees (not supply into LP yet)
+    # fee_mode = 'approximate' credits the whole swap to ranges containing the ending tick
+    # fee_mode = 'swap_replay' splits each swap across the ticks it crossed
     ########################################################               
     def accrue_fees(self,relevant_swaps):   
         
         fees_earned_token_0 = 0.0
         fees_earned_token_1 = 0.0
                 
-        if len(relevant_swaps) > 0:
+        if len(relevant_swaps) > 0 and self.fee_mode == 'swap_replay':
+            fees_earned_token_0,fees_earned_token_1 = self.accrue_fees_swap_replay(relevant_swaps)
+        elif len(relevant_swaps) > 0:
             # For every swap in this time period
-            for s in range(len(relevant_swaps)):
-                for i in range(len(self.liquidity_ranges)):
-                    in_range   = (self.liquidity_ranges[i]['lower_bin_tick'] <= relevant_swaps.iloc[s]['tick_swap']) and \
-                                 (self.liquidity_ranges[i]['upper_bin_tick'] >= relevant_swaps.iloc[s]['tick_swap'])
+            tick_swap         = relevant_swaps['tick_swap'].to_numpy()
+            token_0_in        = relevant_swaps['token0_in'].to_numpy()
+            traded_in         = relevant_swaps['traded_in'].to_numpy()
+            virtual_liquidity = relevant_swaps['virtual_liquidity'].to_numpy()
+            
+            for i in range(len(self.liquidity_ranges)):
+                in_range   = (self.liquidity_ranges[i]['lower_bin_tick'] <= tick_swap) & \
+                             (self.liquidity_ranges[i]['upper_bin_tick'] >= tick_swap)
 
-                    token_0_in = relevant_swaps.iloc[s]['token_in'] == 'token0'
-                    fraction_fees_earned_position = self.liquidity_ranges[i]['position_liquidity']/relevant_swaps.iloc[s]['virtual_liquidity']
+                fraction_fees_earned_position = self.liquidity_ranges[i]['position_liquidity']/virtual_liquidity
+                fees_earned                   = in_range * self.fee_tier * fraction_fees_earned_position * traded_in
 
-                    fees_earned_token_0 += in_range * token_0_in     * self.fee_tier * fraction_fees_earned_position * relevant_swaps.iloc[s]['traded_in']
-                    fees_earned_token_1 += in_range * (1-token_0_in) * self.fee_tier * fraction_fees_earned_position * relevant_swaps.iloc[s]['traded_in']
+                fees_earned_token_0 += fees_earned[token_0_in].sum()
+                fees_earned_token_1 += fees_earned[~token_0_in].sum()
         
         self.token_0_fees_accum += fees_earned_token_0
         self.token_1_fees_accum += fees_earned_token_1
         
         return fees_earned_token_0,fees_earned_token_1            
+    
+    ########################################################
+    # Replay each swap from its pre-swap to its post-swap tick.
+    # Assuming virtual liquidity is constant within a swap, the amount swapped in is linear
+    # in sqrt(P) for token 1 and in 1/sqrt(P) for token 0, so the share of traded_in
+    # earned by a range is the overlap of the swap's path with the range in that space.
+    # Requires the columns added by prepare_swap_replay.
+    # Only returns the fees, accrue_fees adds them to the accumulated fees.
+    ########################################################
+    def accrue_fees_swap_replay(self,relevant_swaps):
+        
+        sqrt_price_pre    = relevant_swaps['sqrt_price_pre'].to_numpy()
+        sqrt_price_post   = relevant_swaps['sqrt_price_post'].to_numpy()
+        tick_swap         = relevant_swaps['tick_swap'].to_numpy()
+        token_0_in        = relevant_swaps['token0_in'].to_numpy()
+        traded_in         = relevant_swaps['traded_in'].to_numpy()
+        virtual_liquidity = relevant_swaps['virtual_liquidity'].to_numpy()
+        
+        path_low          = np.minimum(sqrt_price_pre,sqrt_price_post)
+        path_high         = np.maximum(sqrt_price_pre,sqrt_price_post)
+        crossed           = path_high > path_low
+        
+        fees_earned_token_0 = 0.0
+        fees_earned_token_1 = 0.0
+        
+        for i in range(len(self.liquidity_ranges)):
+            sqrt_price_lower = 1.0001**(self.liquidity_ranges[i]['lower_bin_tick']/2)
+            sqrt_price_upper = 1.0001**(self.liquidity_ranges[i]['upper_bin_tick']/2)
+            overlap_low      = np.clip(path_low, sqrt_price_lower,sqrt_price_upper)
+            overlap_high     = np.clip(path_high,sqrt_price_lower,sqrt_price_upper)
+            
+            with np.errstate(divide='ignore',invalid='ignore'):
+                fraction_token_0 = (1/overlap_low - 1/overlap_high) / (1/path_low - 1/path_high)
+                fraction_token_1 = (overlap_high - overlap_low)     / (path_high - path_low)
+            
+            # Swaps that did not move the price are credited by the ending tick as in the approximate mode
+            in_range         = (self.liquidity_ranges[i]['lower_bin_tick'] <= tick_swap) & \
+                               (self.liquidity_ranges[i]['upper_bin_tick'] >= tick_swap)
+            fraction_in_path = np.where(crossed,np.where(token_0_in,fraction_token_0,fraction_token_1),in_range)
+            
+            fraction_fees_earned_position = self.liquidity_ranges[i]['position_liquidity']/virtual_liquidity
+            fees_earned                   = self.fee_tier * fraction_fees_earned_position * fraction_in_path * traded_in
+            
+            fees_earned_token_0 += fees_earned[token_0_in].sum()
+            fees_earned_token_1 += fees_earned[~token_0_in].sum()
+        
+        return fees_earned_token_0,fees_earned_token_1
      
     ########################################################
     # Rebalance: Remove all liquidity positions
@@ -125,16 +330,54 @@ class StrategyObservation:
         self.token_0_fees_accum = 0.0
         self.token_1_fees_accum = 0.0
         
+        # Burn and collect every position
+        self.pay_gas(n_burn=len(self.liquidity_ranges),n_collect=len(self.liquidity_ranges))
+        
+    ########################################################
+    # Execution costs, only charged if a cost_model was passed
+    # Costs are paid out of liquidity_in_0/1 and recorded in token 0 units
+    ########################################################
+    def pay_gas(self,n_mint=0,n_burn=0,n_collect=0):
+        
+        if self.cost_model is None:
+            return
+        
+        gas_cost                                = self.cost_model.gas_cost(n_mint,n_burn,n_collect)
+        liquidity_in_0,liquidity_in_1           = self.cost_model.deduct_cost(self.liquidity_in_0,self.liquidity_in_1,gas_cost,self.price)
+        self.liquidity_in_0                     = float(liquidity_in_0)
+        self.liquidity_in_1                     = float(liquidity_in_1)
+        self.gas_cost                          += float(gas_cost)
+        
+    def swap_to_ratio(self,lower_tick,upper_tick):
+        
+        if self.cost_model is None or not self.cost_model.SWAP_TO_RATIO:
+            return
+        
+        # Ratio of token 1 to token 0 held by a position in [lower_tick,upper_tick] at the current price
+        amount_0,amount_1                       = UNI_v3_funcs.get_amounts_array(self.price_tick,lower_tick,upper_tick,1.0,self.decimals_0,self.decimals_1)
+        with np.errstate(divide='ignore'):
+            target_ratio                        = amount_1/amount_0
+        
+        liquidity_in_0,liquidity_in_1,swap_cost = self.cost_model.swap_to_ratio(self.liquidity_in_0,self.liquidity_in_1,self.price,target_ratio,
+                                                                                 self.virtual_liquidity,self.fee_tier,self.decimals_0,self.decimals_1)
+        self.liquidity_in_0                     = float(liquidity_in_0)
+        self.liquidity_in_1                     = float(liquidity_in_1)
+        self.swap_cost                         += float(swap_cost)
    
 ########################################################
 # Simulate reset strategy using a Pandas series called price_data, which has as an index
 # the time point, and contains the pool price (token 1 per token 0)
+# With SWAP_TRIGGERED_RESETS the swaps inside each period are also checked, and an extra
+# observation is made at the first swap whose price leaves the strategy's reset range
 ########################################################
 
 def simulate_strategy(price_data,swap_data,strategy_in,
-                       liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1):
+                       liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,fee_mode='approximate',
+                       SWAP_TRIGGERED_RESETS=False,cost_model=None):
 
     strategy_results = []    
+    
+    swap_data        = prepare_simulation_swaps(swap_data,decimals_0,decimals_1,fee_mode,SWAP_TRIGGERED_RESETS)
   
     # Go through every time period in the data that was passet
     for i in range(len(price_data)): 
@@ -144,30 +387,244 @@ def simulate_strategy(price_data,swap_data,strategy_in,
                                               price_data[i],
                                               strategy_in,
                                               liquidity_in_0,liquidity_in_1,
-                                              fee_tier,decimals_0,decimals_1))
+                                              fee_tier,decimals_0,decimals_1,
+                                              cost_model=cost_model,
+                                              virtual_liquidity=initial_virtual_liquidity(swap_data,price_data.index[i])))
         # After initialization
         else:
-            
-            relevant_swaps = swap_data[price_data.index[i-1]:price_data.index[i]]
-            strategy_results.append(StrategyObservation(price_data.index[i],
-                                              price_data[i],
-                                              strategy_in,
-                                              strategy_results[i-1].liquidity_in_0,
-                                              strategy_results[i-1].liquidity_in_1,
-                                              strategy_results[i-1].fee_tier,
-                                              strategy_results[i-1].decimals_0,
-                                              strategy_results[i-1].decimals_1,
-                                              strategy_results[i-1].token_0_left_over,
-                                              strategy_results[i-1].token_1_left_over,
-                                              strategy_results[i-1].token_0_fees,
-                                              strategy_results[i-1].token_1_fees,
-                                              strategy_results[i-1].liquidity_ranges,
-                                              strategy_results[i-1].strategy_info,
-                                              relevant_swaps
-                                              ))
+            strategy_results.extend(simulate_period(strategy_results[-1],price_data,i,swap_data,strategy_in,
+                                                    fee_mode,SWAP_TRIGGERED_RESETS,cost_model))
                 
     return strategy_results
 
+########################################################
+# Add the swap columns needed by the simulation options, once for the whole swap data
+########################################################
+
+def prepare_simulation_swaps(swap_data,decimals_0,decimals_1,fee_mode='approximate',SWAP_TRIGGERED_RESETS=False):
+    
+    if fee_mode == 'swap_replay' and 'sqrt_price_pre' not in swap_data.columns:
+        swap_data = prepare_swap_replay(swap_data)
+        
+    if SWAP_TRIGGERED_RESETS and 'price_swap' not in swap_data.columns:
+        swap_data               = swap_data.copy()
+        swap_data['price_swap'] = tick_to_price(swap_data['tick_swap'].to_numpy(),decimals_0,decimals_1)
+        
+    return swap_data
+
+########################################################
+# Observations made during period i of price_data (after initialization)
+########################################################
+
+def simulate_period(previous_obs,price_data,i,swap_data,strategy_in,fee_mode='approximate',
+                    SWAP_TRIGGERED_RESETS=False,cost_model=None):
+    
+    period_results = []
+    relevant_swaps = swap_data[price_data.index[i-1]:price_data.index[i]]
+    
+    # Step to the first swap that leaves the reset range, as many times as needed
+    while SWAP_TRIGGERED_RESETS and len(relevant_swaps) > 0:
+        swap_prices = relevant_swaps['price_swap'].to_numpy()
+        reset_mask  = strategy_in.reset_mask(swap_prices,strategy_in.strategy_state(previous_obs,previous_obs.strategy_info,swap_prices))
+        if not reset_mask.any():
+            break
+        first_reset  = int(np.argmax(reset_mask))
+        previous_obs = step_strategy(previous_obs,relevant_swaps.index[first_reset],
+                                     swap_prices[first_reset],strategy_in,
+                                     relevant_swaps.iloc[:first_reset+1],fee_mode,cost_model)
+        period_results.append(previous_obs)
+        relevant_swaps = relevant_swaps.iloc[first_reset+1:]
+    
+    period_results.append(step_strategy(previous_obs,price_data.index[i],price_data[i],
+                                        strategy_in,relevant_swaps,fee_mode,cost_model))
+    
+    return period_results
+
+########################################################
+# Sharded simulation: split the timeline into n_shards chunks.
+# Every chunk after the first is simulated speculatively in parallel, starting from a fresh
+# position at its first price. The chunks are then stitched in order: each one is re-run from the
+# true state until the speculative run's state at the same step matches it up to position size,
+# i.e. same ticks, reset decisions and strategy_info, with all token amounts proportional.
+# Without a cost model every step is homogeneous in the amounts held (strategies decide on
+# prices and token ratios), so the rest of the speculative run is rescaled and used.
+# Tolerance: amounts must agree to rtol of the position value once rescaled, so stitched
+# observations differ from simulate_strategy by about rtol (relative). Gas and price impact
+# are not proportional to position size, so with a cost_model the chunks run sequentially.
+########################################################
+
+def simulate_strategy_sharded(price_data,swap_data,strategy_in,
+                              liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,fee_mode='approximate',
+                              SWAP_TRIGGERED_RESETS=False,cost_model=None,n_shards=4,n_workers=None,rtol=1e-9):
+    from concurrent.futures import ProcessPoolExecutor
+    
+    # Every chunk needs at least one period
+    n_shards         = min(n_shards,len(price_data)-1)
+    if n_shards <= 1 or cost_model is not None:
+        return simulate_strategy(price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                                 fee_mode,SWAP_TRIGGERED_RESETS,cost_model)
+    
+    swap_data        = prepare_simulation_swaps(swap_data,decimals_0,decimals_1,fee_mode,SWAP_TRIGGERED_RESETS)
+    bounds           = np.linspace(0,len(price_data),n_shards+1).astype(int)
+    
+    def shard_args(k):
+        shard_prices = price_data.iloc[bounds[k]-1:bounds[k+1]]
+        shard_swaps  = swap_data[shard_prices.index[0]:shard_prices.index[-1]]
+        return (shard_prices,shard_swaps,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                fee_mode,SWAP_TRIGGERED_RESETS,cost_model)
+    
+    with ProcessPoolExecutor(n_workers) as executor:
+        speculative_runs = [executor.submit(simulate_shard,*shard_args(k)) for k in range(1,n_shards)]
+        
+        # First chunk starts from the true initial state
+        strategy_results = simulate_strategy(price_data.iloc[:bounds[1]],swap_data,strategy_in,liquidity_in_0,liquidity_in_1,
+                                             fee_tier,decimals_0,decimals_1,fee_mode,SWAP_TRIGGERED_RESETS,cost_model)
+        
+        for k in range(1,n_shards):
+            speculative = speculative_runs[k-1].result()
+            for j,i in enumerate(range(bounds[k],bounds[k+1])):
+                strategy_results.extend(simulate_period(strategy_results[-1],price_data,i,swap_data,strategy_in,
+                                                        fee_mode,SWAP_TRIGGERED_RESETS,cost_model))
+                scale = observation_scale(strategy_results[-1],speculative[j][-1],rtol)
+                if scale is not None:
+                    strategy_results.extend(rescale_observation(obs,scale) for period in speculative[j+1:] for obs in period)
+                    break
+    
+    return strategy_results
+
+########################################################
+# Speculative run of a chunk, returns the observations of every period after the first price
+########################################################
+
+def simulate_shard(price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                   fee_mode='approximate',SWAP_TRIGGERED_RESETS=False,cost_model=None):
+    
+    previous_obs  = StrategyObservation(price_data.index[0],price_data[0],strategy_in,liquidity_in_0,liquidity_in_1,
+                                        fee_tier,decimals_0,decimals_1,cost_model=cost_model,
+                                        virtual_liquidity=initial_virtual_liquidity(swap_data,price_data.index[0]))
+    shard_results = []
+    
+    for i in range(1,len(price_data)):
+        shard_results.append(simulate_period(previous_obs,price_data,i,swap_data,strategy_in,
+                                             fee_mode,SWAP_TRIGGERED_RESETS,cost_model))
+        previous_obs = shard_results[-1][-1]
+        
+    return shard_results
+
+########################################################
+# Compare a true and a speculative observation up to position size
+# Returns the factor to scale the speculative amounts by, or None if the states differ
+########################################################
+
+SCALED_AMOUNTS = ['liquidity_in_0','liquidity_in_1','token_0_left_over','token_1_left_over',
+                  'token_0_fees_accum','token_1_fees_accum','token_0_fees','token_1_fees']
+RANGE_STATE    = ['lower_bin_tick','upper_bin_tick','reset_time']
+
+def observation_scale(obs_true,obs_speculative,rtol=1e-9):
+    
+    if (obs_true.time,obs_true.price_tick,obs_true.reset_point,obs_true.reset_reason,obs_true.strategy_info) != \
+       (obs_speculative.time,obs_speculative.price_tick,obs_speculative.reset_point,obs_speculative.reset_reason,obs_speculative.strategy_info):
+        return None
+    if [[x.get(key) for key in RANGE_STATE] for x in obs_true.liquidity_ranges] != \
+       [[x.get(key) for key in RANGE_STATE] for x in obs_speculative.liquidity_ranges]:
+        return None
+    
+    # Amounts valued in token 0
+    def amounts(obs):
+        amounts_0 = [getattr(obs,key) for key in SCALED_AMOUNTS[0::2]] + [x['token_0'] for x in obs.liquidity_ranges]
+        amounts_1 = [getattr(obs,key) for key in SCALED_AMOUNTS[1::2]] + [x['token_1'] for x in obs.liquidity_ranges]
+        return np.concatenate([np.array(amounts_0,dtype=float),np.array(amounts_1,dtype=float)/obs.price])
+    
+    amounts_true        = amounts(obs_true)
+    amounts_speculative = amounts(obs_speculative)
+    if amounts_speculative.sum() <= 0.0:
+        return None
+    
+    scale               = amounts_true.sum()/amounts_speculative.sum()
+    if np.abs(amounts_true - scale*amounts_speculative).sum() > rtol*amounts_true.sum():
+        return None
+    return scale
+
+def rescale_observation(obs,scale):
+    
+    obs                  = copy.copy(obs)
+    for key in SCALED_AMOUNTS:
+        setattr(obs,key,getattr(obs,key)*scale)
+    obs.liquidity_ranges = copy.deepcopy(obs.liquidity_ranges)
+    for x in obs.liquidity_ranges:
+        x['token_0']            = x['token_0']*scale
+        x['token_1']            = x['token_1']*scale
+        x['position_liquidity'] = int(x['position_liquidity']*scale)
+    return obs
+
+########################################################
+# Make the next observation of a strategy from the previous one
+########################################################
+
+def step_strategy(previous_obs,timepoint,current_price,strategy_in,relevant_swaps,fee_mode='approximate',cost_model=None):
+    return StrategyObservation(timepoint,
+                               current_price,
+                               strategy_in,
+                               previous_obs.liquidity_in_0,
+                               previous_obs.liquidity_in_1,
+                               previous_obs.fee_tier,
+                               previous_obs.decimals_0,
+                               previous_obs.decimals_1,
+                               previous_obs.token_0_left_over,
+                               previous_obs.token_1_left_over,
+                               previous_obs.token_0_fees_accum,
+                               previous_obs.token_1_fees_accum,
+                               previous_obs.liquidity_ranges,
+                               previous_obs.strategy_info,
+                               relevant_swaps,
+                               fee_mode,
+                               cost_model,
+                               previous_obs.virtual_liquidity)
+
+########################################################
+# Pool virtual liquidity at a time point, from the last swap up to it (None without swaps)
+########################################################
+
+def initial_virtual_liquidity(swap_data,timepoint):
+    swaps_before = swap_data[:timepoint]
+    if len(swaps_before) == 0 or 'virtual_liquidity' not in swaps_before.columns:
+        return None
+    return float(swaps_before['virtual_liquidity'].iloc[-1])
+
+########################################################
+# Convert pool ticks to prices (token 1 per token 0)
+########################################################
+
+def tick_to_price(tick,decimals_0,decimals_1):
+    return 1.0001**tick / 10**(decimals_1 - decimals_0)
+
+########################################################
+# Convert prices (token 1 per token 0) to ticks on the tick spacing,
+# truncating then rounding as StrategyObservation does for its price_tick
+########################################################
+
+def price_to_tick(price,decimals_0,decimals_1,tick_spacing):
+    adjusted_price    = 10**(decimals_1 - decimals_0)*np.atleast_1d(np.asarray(price,dtype=float))
+    TICK_LOG          = np.log(adjusted_price)/np.log(1.0001)
+    # numpy's log can differ from math.log by an ulp, which changes the truncation of prices
+    # at a tick (e.g. swap prices), so those are recomputed as in StrategyObservation
+    AT_TICK           = np.abs(TICK_LOG - np.round(TICK_LOG)) < 1e-6
+    TICK_LOG[AT_TICK] = [math.log(x,1.0001) for x in adjusted_price[AT_TICK]]
+    TICK              = np.round(np.trunc(TICK_LOG)/tick_spacing)*tick_spacing
+    return TICK if np.ndim(price) else TICK[0]
+
+########################################################
+# Add the pre-swap tick and the sqrt price boundaries of every swap
+# so that fees can be attributed along the path of each swap (fee_mode = 'swap_replay')
+########################################################
+
+def prepare_swap_replay(swap_data):
+    swap_data                    = swap_data.sort_index().copy()
+    swap_data['tick_swap_pre']   = swap_data['tick_swap'].shift(1).fillna(swap_data['tick_swap']).astype(int)
+    swap_data['sqrt_price_pre']  = 1.0001**(swap_data['tick_swap_pre'].to_numpy()/2)
+    swap_data['sqrt_price_post'] = 1.0001**(swap_data['tick_swap'].to_numpy()/2)
+    return swap_data
+
 ########################################################
 # Extract Strategy Data
 ########################################################
@@ -212,6 +669,7 @@ def analyze_strategy(data_in,initial_position_value,token_0_usd_data=None):
         data_usd = data_in
         data_usd['cum_fees_usd']       = data_usd['token_0_fees'].cumsum() + (data_usd['token_1_fees'] * data_usd['price_1_0']).cumsum()
         data_usd['value_position_usd'] = data_usd['value_position']
+        data_usd['cum_costs_usd']      = (data_usd['gas_cost'] + data_usd['swap_cost']).cumsum()
     else:
         # Merge in usd price data
         token_0_usd_data['price_0_usd'] = 1/token_0_usd_data['quotePrice']
@@ -224,6 +682,7 @@ def analyze_strategy(data_in,initial_position_value,token_0_usd_data=None):
         data_usd['cum_fees_0']          = data_usd['token_0_fees'].cumsum() + (data_usd['token_1_fees'] * data_usd['price_1_0']).cumsum()
         data_usd['cum_fees_usd']        = data_usd['cum_fees_0']*data_usd['price_0_usd']
         data_usd['value_position_usd']  = data_usd['value_position']*data_usd['price_0_usd']
+        data_usd['cum_costs_usd']       = ((data_usd['gas_cost'] + data_usd['swap_cost'])*data_usd['price_0_usd']).cumsum()
 
 
     days_strategy           = (data_usd['time'].max()-data_usd['time'].min()).days    
@@ -237,14 +696,15 @@ def analyze_strategy(data_in,initial_position_value,token_0_usd_data=None):
                         'gross_fee_return'     : float(strategy_last_obs['cum_fees_usd']/initial_position_value),
                         'net_apr'              : net_apr,
                         'net_return'           : float(strategy_last_obs['value_position_usd']/initial_position_value  - 1),
+                        'execution_cost_return': float(strategy_last_obs['cum_costs_usd']/initial_position_value),
                         'rebalances'           : data_usd['reset_point'].sum(),
                         'max_drawdown'         : ( data_usd['value_position_usd'].max() - data_usd['value_position_usd'].min() ) / data_usd['value_position_usd'].max(),
                         'volatility'           : ((data_usd['value_position_usd'].pct_change().var())**(0.5)) * ((365*24*60)**(0.5)), # Minute frequency data
                         'sharpe_ratio'         : float(net_apr / (((data_usd['value_position_usd'].pct_change().var())**(0.5)) * ((365*24*60)**(0.5)))),
                         'mean_base_position'   : (data_usd['base_position_value']/ \
-                                                  (data_usd['base_position_value']+data_usd['limit_position_value']+data_usd['value_left_over'])).mean(),
+                                                  (data_usd['value_allocated']+data_usd['value_left_over'])).mean(),
                         'median_base_position' : (data_usd['base_position_value']/ \
-                                                  (data_usd['base_position_value']+data_usd['limit_position_value']+data_usd['value_left_over'])).median()
+                                                  (data_usd['value_allocated']+data_usd['value_left_over'])).median()
                     }
     
     return summary_strat
@@ -271,32 +731,35 @@ def plot_strategy(data_strategy,y_axis_label,base_color = '#ff0000'):
         fill='tonexty', # fill area between trace0 and trace1
         mode='lines', line_color=base_color))
 
-    fig_strategy.add_trace(go.Scatter(
-        x=data_strategy['time'], 
-        y=1/data_strategy['limit_range_lower'],
-        fill=None,
-        mode='lines',
-        showlegend = False,
-        line_color='#6f6f6f'))
+    # Limit and reset ranges are only plotted for strategies that have them
+    if 'limit_range_lower' in data_strategy.columns:
+        fig_strategy.add_trace(go.Scatter(
+            x=data_strategy['time'], 
+            y=1/data_strategy['limit_range_lower'],
+            fill=None,
+            mode='lines',
+            showlegend = False,
+            line_color='#6f6f6f'))
 
-    fig_strategy.add_trace(go.Scatter(
-        x=data_strategy['time'], 
-        y=1/data_strategy['limit_range_upper'],
-        name='Base + Limit Position',
-        fill='tonexty', # fill area between trace0 and trace1
-        mode='lines', line_color='#6f6f6f',))
+        fig_strategy.add_trace(go.Scatter(
+            x=data_strategy['time'], 
+            y=1/data_strategy['limit_range_upper'],
+            name='Base + Limit Position',
+            fill='tonexty', # fill area between trace0 and trace1
+            mode='lines', line_color='#6f6f6f',))
 
-    fig_strategy.add_trace(go.Scatter(
-        x=data_strategy['time'], 
-        y=1/data_strategy['reset_range_lower'],
-        name='Strategy Reset Bound',
-        line=dict(width=2,dash='dot',color='black')))
+    if 'reset_range_lower' in data_strategy.columns:
+        fig_strategy.add_trace(go.Scatter(
+            x=data_strategy['time'], 
+            y=1/data_strategy['reset_range_lower'],
+            name='Strategy Reset Bound',
+            line=dict(width=2,dash='dot',color='black')))
 
-    fig_strategy.add_trace(go.Scatter(
-        x=data_strategy['time'], 
-        y=1/data_strategy['reset_range_upper'],
-        showlegend = False,
-        line=dict(width=2,dash='dot',color='black',)))
+        fig_strategy.add_trace(go.Scatter(
+            x=data_strategy['time'], 
+            y=1/data_strategy['reset_range_upper'],
+            showlegend = False,
+            line=dict(width=2,dash='dot',color='black',)))
 
     fig_strategy.add_trace(go.Scatter(
         x=data_strategy['time'], 
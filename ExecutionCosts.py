@@ -0,0 +1,86 @@
+import numpy as np
+
+########################################################
+# Execution cost model for rebalances
+# Gas costs are expressed in units of token 0 per mint, burn and collect call.
+# Swaps are executed against the pool's active (virtual) liquidity, assuming it is
+# constant over the swap, so the price impact and the pool fee are both charged.
+# virtual_liquidity is raw L, as in the swap data's virtual_liquidity column.
+# All methods work on scalars or numpy arrays so they can be reused in vectorized sweeps.
+########################################################
+
+class ExecutionCostModel:
+    def __init__(self,gas_mint=0.0,gas_burn=0.0,gas_collect=0.0,SWAP_TO_RATIO=True):
+
+        self.gas_mint      = gas_mint
+        self.gas_burn      = gas_burn
+        self.gas_collect   = gas_collect
+        self.SWAP_TO_RATIO = SWAP_TO_RATIO
+
+    #####################################
+    # Gas cost in token 0 of a number of contract calls
+    #####################################
+
+    def gas_cost(self,n_mint=0,n_burn=0,n_collect=0):
+        return n_mint*self.gas_mint + n_burn*self.gas_burn + n_collect*self.gas_collect
+
+    #####################################
+    # Pay a cost in token 0 units, from token 0 first and the remainder from token 1
+    # price is token 1 per token 0
+    #####################################
+
+    def deduct_cost(self,amount_0,amount_1,cost_0,price):
+        paid_0   = np.minimum(amount_0,cost_0)
+        paid_1   = np.minimum(amount_1,(cost_0 - paid_0) * price)
+        return amount_0 - paid_0, amount_1 - paid_1
+
+    #####################################
+    # Output of selling token 0 (ZERO_FOR_ONE) or token 1 against virtual liquidity (raw L)
+    # without price impact when virtual_liquidity is None
+    #####################################
+
+    def swap_output(self,amount_in,ZERO_FOR_ONE,price,virtual_liquidity,fee_tier,decimals_0,decimals_1):
+
+        amount_in_after_fee = amount_in * (1 - fee_tier)
+
+        if virtual_liquidity is None:
+            return np.where(ZERO_FOR_ONE,amount_in_after_fee * price,amount_in_after_fee / price)
+
+        # Work in raw token units, sqrt price of token 1 per token 0
+        sqrt_price      = np.sqrt(price * 10**(decimals_1 - decimals_0))
+
+        amount_in_raw_0 = amount_in_after_fee * 10**decimals_0
+        amount_in_raw_1 = amount_in_after_fee * 10**decimals_1
+
+        # Written without differences of sqrt prices, which cancel when the swap is small against L
+        with np.errstate(divide='ignore',invalid='ignore'):
+            # Selling token 0: 1/sqrt(P') = 1/sqrt(P) + dx/L, receive L*(sqrt(P) - sqrt(P')) = L*P*dx/(L + dx*sqrt(P))
+            out_1           = virtual_liquidity * sqrt_price**2 * amount_in_raw_0 / (virtual_liquidity + amount_in_raw_0 * sqrt_price) / 10**decimals_1
+            # Selling token 1: sqrt(P') = sqrt(P) + dy/L, receive L*(1/sqrt(P) - 1/sqrt(P')) = dy/(sqrt(P)*sqrt(P'))
+            out_0           = amount_in_raw_1 / (sqrt_price * (sqrt_price + amount_in_raw_1 / virtual_liquidity)) / 10**decimals_0
+
+        return np.where(ZERO_FOR_ONE,out_1,out_0)
+
+    #####################################
+    # Swap holdings towards target_ratio (token 1 per token 0 amounts, inf for token 1 only)
+    # The amount to swap is sized at the pre-trade price; price impact makes the final ratio
+    # slightly short of the target, and the remainder is left over as usual.
+    # Returns new amounts and the cost in token 0 versus a frictionless swap at price
+    #####################################
+
+    def swap_to_ratio(self,amount_0,amount_1,price,target_ratio,virtual_liquidity,fee_tier,decimals_0,decimals_1):
+
+        value_0          = amount_0 + amount_1 / price
+        target_0         = value_0 / (1 + target_ratio / price)
+        ZERO_FOR_ONE     = amount_0 > target_0
+        amount_in        = np.where(ZERO_FOR_ONE,amount_0 - target_0,(target_0 - amount_0) * price)
+        amount_in        = np.clip(amount_in,0.0,np.where(ZERO_FOR_ONE,amount_0,amount_1))
+
+        amount_out       = self.swap_output(amount_in,ZERO_FOR_ONE,price,virtual_liquidity,fee_tier,decimals_0,decimals_1)
+        amount_out       = np.nan_to_num(amount_out)
+
+        new_amount_0     = np.where(ZERO_FOR_ONE,amount_0 - amount_in,amount_0 + amount_out)
+        new_amount_1     = np.where(ZERO_FOR_ONE,amount_1 + amount_out,amount_1 - amount_in)
+        swap_cost        = value_0 - (new_amount_0 + new_amount_1 / price)
+
+        return new_amount_0,new_amount_1,swap_cost
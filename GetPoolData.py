@@ -1,37 +1,41 @@
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 import requests
 import pickle
 import importlib
 from itertools import compress
+
+# Default endpoints, every loader also accepts its own url (e.g. a local ReplayServer)
+UNIV3_GRAPH_URL = 'https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3'
+BITQUERY_URL    = 'https://graphql.bitquery.io/'
     
 # Extract all Mint, Burn, and Swap Events
 # From a given pool
 # Returns json requests
 
-def query_univ3_graph(query: str, variables=None) -> dict:
-    univ3_graph_url = 'https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3'
+def query_univ3_graph(query: str, variables=None, url=UNIV3_GRAPH_URL) -> dict:
     """Make graphql query to subgraph"""
     if variables:
         params = {'query': query, 'variables': variables}
     else:
         params = {'query': query}
-    response = requests.post(univ3_graph_url, json=params)
+    response = requests.post(url, json=params)
     return response.json()
 
-def get_swap_data(contract_address,file_name,DOWNLOAD_DATA=False):        
+def get_swap_data(contract_address,file_name,DOWNLOAD_DATA=False,url=UNIV3_GRAPH_URL):        
         
     request_swap = [] 
     
     if DOWNLOAD_DATA:
 
         current_payload = generate_fist_event_payload('swaps',contract_address)
-        current_id      = query_univ3_graph(current_payload)['data']['pool']['swaps'][0]['id']
+        current_id      = query_univ3_graph(current_payload,url=url)['data']['pool']['swaps'][0]['id']
         finished        = False
 
         while not finished:
             current_payload = generate_event_payload('swaps',contract_address,str(1000))
-            response        = query_univ3_graph(current_payload,{'paginateId':current_id})['data']['pool']['swaps']
+            response        = query_univ3_graph(current_payload,{'paginateId':current_id},url)['data']['pool']['swaps']
 
             if len(response) == 0:
                 finished = True
@@ -49,6 +53,7 @@ def get_swap_data(contract_address,file_name,DOWNLOAD_DATA=False):
 
 ##############################################################
 # Get Pool Virtual Liquidity Data using Flipside Data Pool Stats Table
+# flipside_query is the list of query result urls
 ##############################################################
 def get_liquidity_flipside(flipside_query,file_name,DOWNLOAD_DATA = False):
     
@@ -70,14 +75,16 @@ def get_liquidity_flipside(flipside_query,file_name,DOWNLOAD_DATA = False):
 ##############################################################
 # Get all swaps for the pool using flipside data's price feed
 # For the contract's liquidity
+# Flipside's VIRTUAL_LIQUIDITY_ADJUSTED is divided by 10**((decimals_0+decimals_1)/2),
+# it is converted back to raw L so it can be compared with position_liquidity
 ##############################################################
-def get_pool_data_flipside(contract_address,flipside_query,file_name,DOWNLOAD_DATA = False):
+def get_pool_data_flipside(contract_address,flipside_query,file_name,decimals_0,decimals_1,DOWNLOAD_DATA = False,graph_url=UNIV3_GRAPH_URL):
 
     # Download  events
-    swap_data               = get_swap_data(contract_address,file_name,DOWNLOAD_DATA)
+    swap_data               = get_swap_data(contract_address,file_name,DOWNLOAD_DATA,graph_url)
+    swap_data['timestamp']  = swap_data['timestamp'].astype('int64')
     swap_data['time_pd']    = pd.to_datetime(swap_data['timestamp'], unit='s', origin='unix',utc=True)
     swap_data               = swap_data.set_index('time_pd')
-    swap_data['tick_swap']  = swap_data['tick']
     swap_data               = swap_data.sort_index()
     
     # Download pool liquidity data
@@ -89,18 +96,42 @@ def get_pool_data_flipside(contract_address,flipside_query,file_name,DOWNLOAD_DA
     
     full_data               = pd.merge_asof(swap_data,stats_data[['VIRTUAL_LIQUIDITY_ADJUSTED','tick_pool']],on='time_pd',direction='backward',allow_exact_matches = False)
     full_data               = full_data.set_index('time_pd')
-    # token with negative amounts is the token being swapped in
-    full_data['tick_swap']       = full_data['tick_swap'].astype(int)
-    full_data['amount0']         = full_data['amount0'].astype(float)
-    full_data['amount1']         = full_data['amount1'].astype(float)
-    full_data['token_in']        = full_data.apply(lambda x: 'token0' if (x['amount0'] < 0) else 'token1',axis=1)
+    full_data['virtual_liquidity'] = full_data['VIRTUAL_LIQUIDITY_ADJUSTED'] * 10**((decimals_0 + decimals_1)/2)
+    full_data               = full_data.drop(columns=['VIRTUAL_LIQUIDITY_ADJUSTED'])
+    
+    return normalize_swap_data(full_data,contract_address)
+
+##############################################################
+# Convert swap data to the compact numeric columns used by the framework
+#   token0_in         : bool, token 0 was swapped in
+#   traded_in         : float64, amount of the token swapped in
+#   tick_swap         : int32, pool tick after the swap
+#   virtual_liquidity : float64, active liquidity of the pool in raw L units (as position_liquidity)
+#   pool              : categorical pool address
+# The event id and timestamp are dropped, they are only needed for pagination and indexing
+##############################################################
+def normalize_swap_data(swap_data,contract_address):
+    
+    swap_data                      = swap_data.drop(columns=['id','timestamp'],errors='ignore')
+    swap_data                      = swap_data.rename(columns={'tick':'tick_swap'})
+    swap_data['tick_swap']         = swap_data['tick_swap'].astype('int32')
+    swap_data['amount0']           = swap_data['amount0'].astype('float64')
+    swap_data['amount1']           = swap_data['amount1'].astype('float64')
+    if 'amountUSD' in swap_data.columns:
+        swap_data['amountUSD']     = swap_data['amountUSD'].astype('float64')
     
-    return full_data
+    # amounts are from the pool's perspective, the token with a positive amount is the token being swapped in
+    swap_data['token0_in']         = swap_data['amount0'].to_numpy() > 0
+    swap_data['traded_in']         = np.abs(np.where(swap_data['token0_in'],swap_data['amount0'],swap_data['amount1']))
+    swap_data['virtual_liquidity'] = swap_data['virtual_liquidity'].astype('float64')
+    swap_data['pool']              = pd.Categorical.from_codes(np.zeros(len(swap_data),dtype='int8'),[contract_address])
+    
+    return swap_data
 
 ##############################################################
 # Get Price Data from Bitquery
 ##############################################################
-def get_price_data_bitquery(token_0_address,token_1_address,date_begin,date_end,api_token,file_name,DOWNLOAD_DATA = False,RATE_LIMIT=True):
+def get_price_data_bitquery(token_0_address,token_1_address,date_begin,date_end,api_token,file_name,DOWNLOAD_DATA = False,RATE_LIMIT=True,url=BITQUERY_URL):
 
     request = []
     
@@ -110,12 +141,12 @@ def get_price_data_bitquery(token_0_address,token_1_address,date_begin,date_end,
             months_to_request = pd.date_range(date_begin,date_end,freq="M").strftime("%Y-%m-%d").tolist()
                 
             for i in range(len(months_to_request)-1):             
-                request.append(run_query(generate_price_payload(token_0_address,token_1_address,months_to_request[i],months_to_request[i+1]),api_token))
+                request.append(run_query(generate_price_payload(token_0_address,token_1_address,months_to_request[i],months_to_request[i+1]),api_token,url))
             with open('./data/'+file_name+'_1min.pkl', 'wb') as output:
                 pickle.dump(request, output, pickle.HIGHEST_PROTOCOL)
         else:
             # Otherwise just download the data
-            request.append(run_query(generate_price_payload(token_0_address,token_1_address,date_begin,date_end),api_token))
+            request.append(run_query(generate_price_payload(token_0_address,token_1_address,date_begin,date_end),api_token,url))
     else:
         with open('./data/'+file_name+'_1min.pkl', 'rb') as input:
             request = pickle.load(input)
@@ -138,6 +169,8 @@ def get_price_data_bitquery(token_0_address,token_1_address,date_begin,date_end,
     price_data['time']    = pd.to_datetime(price_data['time'], format = '%Y-%m-%d %H:%M:%S')
     price_data['time_pd'] = pd.to_datetime(price_data['time'],utc=True)
     price_data            = price_data.set_index('time_pd')
+    price_data            = price_data.astype({'baseCurrency':'category','quoteCurrency':'category',
+                                               'baseAmount':'float64','quoteAmount':'float64','quotePrice':'float64'})
 
     return price_data
 
@@ -187,6 +220,20 @@ def generate_fist_event_payload(event,address):
                     }'''
         return payload
 
+def generate_pool_tick_payload(addresses):
+        payload = '''{
+                      pools(
+                      first: '''+str(len(addresses))+'''
+                      where: {
+                        id_in: ['''+','.join('"'+x+'"' for x in addresses)+''']
+                      }
+                        ) {
+                          id
+                          tick
+                        }
+                    }'''
+        return payload
+
 def generate_price_payload(token_0_address,token_1_address,date_begin,date_end):
     payload =   '''{
                   ethereum(network: ethereum) {
@@ -223,8 +270,7 @@ def generate_price_payload(token_0_address,token_1_address,date_begin,date_end):
 ##############################################################
 # A simple function to use requests.post to make the API call
 ##############################################################
-def run_query(query,api_token):  
-    url       = 'https://graphql.bitquery.io/'
+def run_query(query,api_token,url=BITQUERY_URL):  
     headers = {'X-API-KEY': api_token}
     request = requests.post(url,
                             json={'query': query}, headers=headers)
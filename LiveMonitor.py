@@ -0,0 +1,118 @@
+import asyncio
+import pandas as pd
+import GetPoolData
+import ActiveStrategyFramework
+
+########################################################
+# Live monitoring of strategy positions across many pools
+# Every poll fetches the current tick of all pools with a single call to the price source,
+# updates each pool's StrategyObservation (no swaps, so only the ranges are updated)
+# and emits a signal whenever the strategy decides to rebalance.
+# All state is kept in memory.
+########################################################
+
+########################################################
+# Price sources
+# A price source provides: async get_ticks(addresses) -> dict of address : tick
+########################################################
+
+class SubgraphPriceSource:
+    def __init__(self,query_function=GetPoolData.query_univ3_graph):
+        self.query_function = query_function
+
+    async def get_ticks(self,addresses):
+        # One request for all pools, run off the event loop
+        loop     = asyncio.get_running_loop()
+        response = await loop.run_in_executor(None,self.query_function,GetPoolData.generate_pool_tick_payload(addresses))
+        return {x['id']: int(x['tick']) for x in response['data']['pools'] if x['tick'] is not None}
+
+class ReplayPriceSource:
+    # Replays the tick_swap column of swap data (e.g. from GetPoolData.get_pool_data_flipside)
+    # one swap per poll for every pool
+    def __init__(self,swap_data_by_pool):
+        self.ticks    = {address: swap_data['tick_swap'].to_numpy() for address,swap_data in swap_data_by_pool.items()}
+        self.position = {address: 0 for address in swap_data_by_pool}
+
+    async def get_ticks(self,addresses):
+        ticks = dict()
+        for address in addresses:
+            if self.position[address] < len(self.ticks[address]):
+                ticks[address]          = int(self.ticks[address][self.position[address]])
+                self.position[address] += 1
+        return ticks
+
+    def finished(self):
+        return all(self.position[x] >= len(self.ticks[x]) for x in self.ticks)
+
+########################################################
+# Monitor
+# pools: dict of address : dict with the keys
+#   strategy, liquidity_in_0, liquidity_in_1, fee_tier, decimals_0, decimals_1
+########################################################
+
+class LiveMonitor:
+    def __init__(self,pools,price_source,poll_interval=12.0):
+
+        self.pools         = pools
+        self.price_source  = price_source
+        self.poll_interval = poll_interval
+        self.observations  = dict()
+        self.last_tick     = dict()
+        self.signals       = asyncio.Queue()
+
+    #####################################
+    # Update every pool with new ticks and queue the rebalance signals
+    #####################################
+
+    def update(self,ticks,timepoint=None):
+
+        if timepoint is None:
+            timepoint = pd.Timestamp.now(tz='UTC')
+
+        signals = []
+
+        for address,tick in ticks.items():
+            # Nothing to do if the pool price did not move
+            if self.last_tick.get(address) == tick:
+                continue
+            self.last_tick[address] = tick
+
+            pool  = self.pools[address]
+            price = ActiveStrategyFramework.tick_to_price(tick,pool['decimals_0'],pool['decimals_1'])
+
+            if address not in self.observations:
+                self.observations[address] = ActiveStrategyFramework.StrategyObservation(timepoint,price,pool['strategy'],
+                                                                                          pool['liquidity_in_0'],pool['liquidity_in_1'],
+                                                                                          pool['fee_tier'],pool['decimals_0'],pool['decimals_1'])
+            else:
+                self.observations[address] = ActiveStrategyFramework.step_strategy(self.observations[address],timepoint,price,
+                                                                                   pool['strategy'],None)
+
+            if self.observations[address].reset_point:
+                signals.append({'pool'             : address,
+                                'time'             : timepoint,
+                                'price'            : price,
+                                'tick'             : tick,
+                                'reset_reason'     : self.observations[address].reset_reason,
+                                'liquidity_ranges' : self.observations[address].liquidity_ranges})
+
+        for signal in signals:
+            self.signals.put_nowait(signal)
+
+        return signals
+
+    async def poll(self):
+        ticks = await self.price_source.get_ticks(list(self.pools.keys()))
+        return self.update(ticks)
+
+    #####################################
+    # Poll until stopped (or max_polls is reached)
+    #####################################
+
+    async def run(self,max_polls=None):
+
+        n_polls = 0
+        while max_polls is None or n_polls < max_polls:
+            await self.poll()
+            n_polls += 1
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,222 @@
+import pandas as pd
+import numpy as np
+import UNI_v3_funcs
+import ActiveStrategyFramework
+
+########################################################
+# Monte Carlo scenarios for strategy evaluation
+# Price paths are built by (block) bootstrapping the empirical price_return of model_data
+# (e.g. from ActiveStrategyFramework.aggregate_price_data). If swap data is given, the swap
+# flow of each period is resampled together with its return, so volume stays tied to moves.
+# All paths are held as 2-D arrays of shape (n_paths, n_steps + 1), column 0 being the start.
+########################################################
+
+def generate_scenarios(model_data,initial_price,n_steps,n_paths,block_size=1,swap_data=None,seed=None):
+
+    rng          = np.random.default_rng(seed)
+    returns      = model_data['price_return'].to_numpy()
+    n_obs        = len(returns)
+    block_size   = min(block_size,n_obs)
+
+    # Draw blocks of consecutive periods and concatenate them for every path
+    n_blocks     = int(np.ceil(n_steps/block_size))
+    block_starts = rng.integers(0,n_obs-block_size+1,size=(n_paths,n_blocks))
+    sample_index = (block_starts[:,:,None] + np.arange(block_size)).reshape(n_paths,-1)[:,:n_steps]
+
+    price        = np.empty((n_paths,n_steps+1))
+    price[:,0]   = initial_price
+    price[:,1:]  = initial_price * np.cumprod(1 + returns[sample_index],axis=1)
+
+    scenarios    = {'price': price}
+
+    if swap_data is not None:
+        flow = aggregate_swap_flow(model_data,swap_data)
+        for column in ['volume_token_0','volume_token_1','virtual_liquidity']:
+            scenarios[column]        = np.zeros((n_paths,n_steps+1))
+            scenarios[column][:,1:]  = flow[column].to_numpy()[sample_index]
+
+    return scenarios
+
+########################################################
+# Sum the swap flow of each model_data period (previous index, index]
+########################################################
+
+def aggregate_swap_flow(model_data,swap_data):
+
+    period       = np.searchsorted(model_data.index.values,swap_data.index.values,side='left')
+    valid        = (period > 0) & (period < len(model_data))
+    period       = period[valid]
+    token_0_in   = swap_data['token0_in'].to_numpy()[valid]
+    traded_in    = swap_data['traded_in'].to_numpy()[valid]
+
+    flow = pd.DataFrame({
+        'volume_token_0'   : np.bincount(period,weights=traded_in*token_0_in,      minlength=len(model_data)),
+        'volume_token_1'   : np.bincount(period,weights=traded_in*(~token_0_in),   minlength=len(model_data)),
+        'virtual_liquidity': pd.Series(swap_data['virtual_liquidity'].to_numpy()[valid]).groupby(period).last() \
+                               .reindex(range(len(model_data))).ffill().bfill().to_numpy()
+        },index=model_data.index)
+
+    return flow
+
+########################################################
+# Simulate a strategy over all scenario paths at once
+# Position values, fees and reset checks (Strategy.check_reset_batch) are vectorized over paths.
+# The paths that reset at a step are set in one call of the strategy's set_liquidity_ranges_batch,
+# strategies without it fall back to set_liquidity_ranges one path at a time.
+# Fees are credited to ranges containing the period's ending price, as in the approximate fee mode.
+# Returns one row per path with its net APR, fee return and number of rebalances
+########################################################
+
+def simulate_scenarios(scenarios,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                       days_per_step,cost_model=None):
+
+    price              = scenarios['price']
+    n_paths,n_points   = price.shape
+    tick_spacing       = int(fee_tier*2*10000)
+    # Same tick rounding as StrategyObservation, so amounts use the ticks ranges are placed against
+    price_tick         = ActiveStrategyFramework.price_to_tick(price,decimals_0,decimals_1,tick_spacing)
+    has_flow           = 'volume_token_0' in scenarios
+
+    # All paths start at the same price, so the initial ranges are shared
+    first_obs          = ActiveStrategyFramework.StrategyObservation(0,price[0,0],strategy_in,liquidity_in_0,liquidity_in_1,
+                                                                     fee_tier,decimals_0,decimals_1,cost_model=cost_model)
+    n_ranges           = len(first_obs.liquidity_ranges)
+    lower_tick         = np.tile([x['lower_bin_tick'] for x in first_obs.liquidity_ranges],(n_paths,1)).astype(float)
+    upper_tick         = np.tile([x['upper_bin_tick'] for x in first_obs.liquidity_ranges],(n_paths,1)).astype(float)
+    position_liquidity = np.tile([x['position_liquidity'] for x in first_obs.liquidity_ranges],(n_paths,1)).astype(float)
+    strategy_info      = {key: np.full(n_paths,value,dtype=float) for key,value in first_obs.strategy_info.items()}
+    left_over_0        = np.full(n_paths,first_obs.token_0_left_over)
+    left_over_1        = np.full(n_paths,first_obs.token_1_left_over)
+    fees_accum_0       = np.zeros(n_paths)
+    fees_accum_1       = np.zeros(n_paths)
+    fees_total         = np.zeros(n_paths)
+    costs_total        = np.full(n_paths,first_obs.gas_cost + first_obs.swap_cost)
+    rebalances         = np.zeros(n_paths,dtype=int)
+
+    initial_value      = liquidity_in_0 + liquidity_in_1/price[0,0]
+    BATCH_RESETS       = type(strategy_in).set_liquidity_ranges_batch is not ActiveStrategyFramework.Strategy.set_liquidity_ranges_batch
+
+    for t in range(1,n_points):
+
+        tick                 = price_tick[:,t,None]
+        token_0,token_1      = UNI_v3_funcs.get_amounts_array(tick,lower_tick,upper_tick,position_liquidity,decimals_0,decimals_1)
+
+        # Accrue fees of the period
+        if has_flow:
+            in_range         = (lower_tick <= tick) & (upper_tick >= tick)
+            with np.errstate(divide='ignore',invalid='ignore'):
+                fraction     = np.nan_to_num(in_range * position_liquidity / scenarios['virtual_liquidity'][:,t,None]).sum(axis=1)
+            fees_0           = fee_tier * fraction * scenarios['volume_token_0'][:,t]
+            fees_1           = fee_tier * fraction * scenarios['volume_token_1'][:,t]
+            fees_accum_0    += fees_0
+            fees_accum_1    += fees_1
+            fees_total      += fees_0 + fees_1/price[:,t]
+
+        # Check which paths need a rebalance
+        strategy_state            = dict(strategy_info)
+        strategy_state['token_0'] = token_0
+        strategy_state['token_1'] = token_1
+        reset_paths               = np.flatnonzero(strategy_in.reset_mask(price[:,t],strategy_state))
+
+        if len(reset_paths) == 0:
+            continue
+
+        # Remove liquidity, claim fees and pay for burning and collecting
+        amount_0             = token_0[reset_paths].sum(axis=1) + left_over_0[reset_paths] + fees_accum_0[reset_paths]
+        amount_1             = token_1[reset_paths].sum(axis=1) + left_over_1[reset_paths] + fees_accum_1[reset_paths]
+        fees_accum_0[reset_paths] = 0.0
+        fees_accum_1[reset_paths] = 0.0
+        rebalances[reset_paths]  += 1
+
+        if cost_model is not None:
+            gas_cost             = cost_model.gas_cost(n_burn=n_ranges,n_collect=n_ranges)
+            amount_0,amount_1    = cost_model.deduct_cost(amount_0,amount_1,gas_cost,price[reset_paths,t])
+            costs_total[reset_paths] += gas_cost
+
+        # Set the new ranges with the strategy, for all resetting paths at once if it supports it
+        if BATCH_RESETS:
+            reset_obs                       = ObservationBatch(t,price[reset_paths,t],amount_0,amount_1,fee_tier,decimals_0,decimals_1,cost_model=cost_model,
+                                                               virtual_liquidity=scenarios['virtual_liquidity'][reset_paths,t] if has_flow else None)
+            ranges,reset_info               = strategy_in.set_liquidity_ranges_batch(reset_obs)
+            lower_tick[reset_paths]         = np.column_stack([x['lower_bin_tick'] for x in ranges])
+            upper_tick[reset_paths]         = np.column_stack([x['upper_bin_tick'] for x in ranges])
+            position_liquidity[reset_paths] = np.column_stack([x['position_liquidity'] for x in ranges])
+            for key,value in reset_info.items():
+                strategy_info[key][reset_paths] = value
+            left_over_0[reset_paths]        = reset_obs.token_0_left_over
+            left_over_1[reset_paths]        = reset_obs.token_1_left_over
+            costs_total[reset_paths]       += reset_obs.gas_cost + reset_obs.swap_cost
+        else:
+            for j,path in enumerate(reset_paths):
+                reset_obs                = ActiveStrategyFramework.StrategyObservation(t,price[path,t],strategy_in,amount_0[j],amount_1[j],
+                                                                                       fee_tier,decimals_0,decimals_1,cost_model=cost_model,
+                                                                                       virtual_liquidity=scenarios['virtual_liquidity'][path,t] if has_flow else None)
+                lower_tick[path]         = [x['lower_bin_tick'] for x in reset_obs.liquidity_ranges]
+                upper_tick[path]         = [x['upper_bin_tick'] for x in reset_obs.liquidity_ranges]
+                position_liquidity[path] = [x['position_liquidity'] for x in reset_obs.liquidity_ranges]
+                for key,value in reset_obs.strategy_info.items():
+                    strategy_info[key][path] = value
+                left_over_0[path]        = reset_obs.token_0_left_over
+                left_over_1[path]        = reset_obs.token_1_left_over
+                costs_total[path]       += reset_obs.gas_cost + reset_obs.swap_cost
+
+    # Final value of every path
+    token_0,token_1    = UNI_v3_funcs.get_amounts_array(price_tick[:,-1,None],lower_tick,upper_tick,position_liquidity,decimals_0,decimals_1)
+    value_position     = token_0.sum(axis=1) + left_over_0 + fees_accum_0 + \
+                         (token_1.sum(axis=1) + left_over_1 + fees_accum_1)/price[:,-1]
+    days_strategy      = (n_points-1)*days_per_step
+
+    return pd.DataFrame({'net_apr'              : (value_position/initial_value - 1) * 365 / days_strategy,
+                         'net_return'           : value_position/initial_value - 1,
+                         'gross_fee_return'     : fees_total/initial_value,
+                         'execution_cost_return': costs_total/initial_value,
+                         'rebalances'           : rebalances})
+
+########################################################
+# Array counterpart of StrategyObservation for the paths resetting at a step,
+# passed to Strategy.set_liquidity_ranges_batch. Amounts, prices and costs are arrays over paths.
+########################################################
+
+class ObservationBatch:
+    def __init__(self,timepoint,current_price,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                 cost_model=None,virtual_liquidity=None):
+        
+        self.time               = timepoint
+        self.price              = np.asarray(current_price,dtype=float)
+        self.liquidity_in_0     = np.asarray(liquidity_in_0,dtype=float)
+        self.liquidity_in_1     = np.asarray(liquidity_in_1,dtype=float)
+        self.fee_tier           = fee_tier
+        self.decimals_0         = decimals_0
+        self.decimals_1         = decimals_1
+        self.decimal_adjustment = 10**(self.decimals_1  - self.decimals_0)
+        self.tickSpacing        = int(self.fee_tier*2*10000)
+        self.cost_model         = cost_model
+        self.virtual_liquidity  = virtual_liquidity
+        self.token_0_left_over  = np.zeros(len(self.price))
+        self.token_1_left_over  = np.zeros(len(self.price))
+        self.gas_cost           = np.zeros(len(self.price))
+        self.swap_cost          = np.zeros(len(self.price))
+        
+        self.price_tick         = ActiveStrategyFramework.price_to_tick(self.price,self.decimals_0,self.decimals_1,self.tickSpacing)
+    
+    def pay_gas(self,n_mint=0,n_burn=0,n_collect=0):
+        
+        if self.cost_model is None:
+            return
+        
+        gas_cost                                = self.cost_model.gas_cost(n_mint,n_burn,n_collect)
+        self.liquidity_in_0,self.liquidity_in_1 = self.cost_model.deduct_cost(self.liquidity_in_0,self.liquidity_in_1,gas_cost,self.price)
+        self.gas_cost                           = self.gas_cost + gas_cost
+    
+    def swap_to_ratio(self,lower_tick,upper_tick):
+        
+        if self.cost_model is None or not self.cost_model.SWAP_TO_RATIO:
+            return
+        
+        amount_0,amount_1                       = UNI_v3_funcs.get_amounts_array(self.price_tick,lower_tick,upper_tick,1.0,self.decimals_0,self.decimals_1)
+        with np.errstate(divide='ignore'):
+            target_ratio                        = amount_1/amount_0
+        
+        self.liquidity_in_0,self.liquidity_in_1,swap_cost = self.cost_model.swap_to_ratio(self.liquidity_in_0,self.liquidity_in_1,self.price,target_ratio,
+                                                                                           self.virtual_liquidity,self.fee_tier,self.decimals_0,self.decimals_1)
+        self.swap_cost                          = self.swap_cost + swap_cost
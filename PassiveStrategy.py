@@ -0,0 +1,52 @@
+import numpy as np
+import UNI_v3_funcs
+import ActiveStrategyFramework
+
+########################################################
+# Passive strategy: a single full range position that is never reset
+# Serves as a benchmark for the active strategies
+########################################################
+
+class PassiveStrategy(ActiveStrategyFramework.Strategy):
+    
+    RANGE_NAMES = ('base',)
+    
+    # Largest tick allowed by the Uniswap v3 contracts
+    MAX_TICK    = 887272
+    
+    def check_reset_batch(self,prices,strategy_state):
+        return {'never' : np.zeros(np.shape(prices),dtype=bool)}
+    
+    def set_liquidity_ranges(self,current_strat_obs):
+        
+        TICK_A                  = -int(self.MAX_TICK/current_strat_obs.tickSpacing)*current_strat_obs.tickSpacing
+        TICK_B                  =  int(self.MAX_TICK/current_strat_obs.tickSpacing)*current_strat_obs.tickSpacing
+        
+        current_strat_obs.pay_gas(n_mint=1)
+        current_strat_obs.swap_to_ratio(TICK_A,TICK_B)
+        
+        liquidity_placed        = int(UNI_v3_funcs.get_liquidity(current_strat_obs.price_tick,TICK_A,TICK_B,current_strat_obs.liquidity_in_0, \
+                                                                 current_strat_obs.liquidity_in_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1))
+        base_0_amount,base_1_amount = UNI_v3_funcs.get_amounts(current_strat_obs.price_tick,TICK_A,TICK_B,liquidity_placed, \
+                                                               current_strat_obs.decimals_0,current_strat_obs.decimals_1)
+        
+        base_liq_range =       {'price'              : current_strat_obs.price,
+                                'lower_bin_tick'     : TICK_A,
+                                'upper_bin_tick'     : TICK_B,
+                                'lower_bin_price'    : 1.0001**TICK_A / current_strat_obs.decimal_adjustment,
+                                'upper_bin_price'    : 1.0001**TICK_B / current_strat_obs.decimal_adjustment,
+                                'time'               : current_strat_obs.time,
+                                'token_0'            : base_0_amount,
+                                'token_1'            : base_1_amount,
+                                'position_liquidity' : liquidity_placed,
+                                'reset_time'         : current_strat_obs.time}
+        
+        # How much liquidity is not allcated to ranges
+        current_strat_obs.token_0_left_over = max([current_strat_obs.liquidity_in_0 - base_0_amount,0.0])
+        current_strat_obs.token_1_left_over = max([current_strat_obs.liquidity_in_1 - base_1_amount,0.0])
+        
+        # Since liquidity was allocated, set to 0
+        current_strat_obs.liquidity_in_0 = 0.0
+        current_strat_obs.liquidity_in_1 = 0.0
+        
+        return [base_liq_range],dict()
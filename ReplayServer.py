@@ -0,0 +1,147 @@
+import json
+import pickle
+import re
+from bisect import bisect_left, bisect_right
+import threading
+import time
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+########################################################
+# Local stand-in for the remote data APIs, serving the cached datasets in ./data/
+# with the same query shapes GetPoolData sends:
+#   POST /subgraph        : generate_event_payload / generate_fist_event_payload (swaps)
+#   POST /bitquery        : generate_price_payload
+#   GET  /flipside/<i>    : the i-th pool stats query result
+# latency (seconds) is added to every request and page_size caps the events per page,
+# so ingestion can be benchmarked deterministically and offline, e.g.
+#
+#   server = ReplayServer('eth_usdc',latency=0.05).start()
+#   GetPoolData.get_swap_data(address,'eth_usdc_replay',True,url=server.url+'/subgraph')
+#   GetPoolData.get_price_data_bitquery(...,url=server.url+'/bitquery')
+#   GetPoolData.get_liquidity_flipside(server.flipside_urls(),'eth_usdc_replay',True)
+#   server.stop()
+########################################################
+
+class ReplayServer:
+    def __init__(self,file_name,data_dir='./data/',latency=0.0,page_size=1000,host='127.0.0.1',port=0):
+
+        self.latency   = latency
+        self.page_size = page_size
+        self.host      = host
+        self.port      = port
+
+        self.swaps       = self.load_pickle(data_dir+file_name+'_swap.pkl',[])
+        self.swaps       = sorted(self.swaps,key=lambda x: x['id'])
+        self.swap_ids    = [x['id'] for x in self.swaps]
+        price_requests   = self.load_pickle(data_dir+file_name+'_1min.pkl',[])
+        dex_trades       = [x for request in price_requests for x in request['data']['ethereum']['dexTrades']]
+        # Trade minutes are parsed once, trades are kept in time order for bisecting date ranges
+        trade_times      = pd.to_datetime([x['timeInterval']['minute'] for x in dex_trades])
+        order            = trade_times.argsort(kind='stable')
+        self.dex_trades  = [dex_trades[i] for i in order]
+        self.trade_times = list(trade_times[order])
+        self.pool_stats  = [x.to_dict(orient='records') for x in self.load_pickle(data_dir+file_name+'_liquidity.pkl',[])]
+
+        self.server      = None
+        self.thread      = None
+
+    def load_pickle(self,path,default):
+        try:
+            with open(path,'rb') as input:
+                return pickle.load(input)
+        except FileNotFoundError:
+            return default
+
+    @property
+    def url(self):
+        return 'http://'+self.host+':'+str(self.server.server_address[1])
+
+    def flipside_urls(self):
+        return [self.url+'/flipside/'+str(i) for i in range(len(self.pool_stats))]
+
+    #####################################
+    # Query handlers, return the json body
+    #####################################
+
+    def query_subgraph(self,body):
+        query     = body['query']
+        variables = body.get('variables') or {}
+
+        event     = re.search(r'(\w+)\(\s*first',query).group(1)
+        n_query   = min(int(re.search(r'first:\s*(\d+)',query).group(1)),self.page_size)
+
+        # Events are ordered by id, paginated by id_gt
+        start     = 0
+        if 'paginateId' in variables:
+            start = bisect_right(self.swap_ids,variables['paginateId'])
+
+        events    = self.swaps[start:start+n_query] if event == 'swaps' else []
+        return {'data': {'pool': {event: events}}}
+
+    def query_bitquery(self,body):
+        date_begin,date_end = re.search(r'between:\s*\["([^"]+)","([^"]+)"\]',body['query']).groups()
+        date_begin          = pd.Timestamp(date_begin)
+        date_end            = pd.Timestamp(date_end) + pd.Timedelta(days=1)
+        dex_trades          = self.dex_trades[bisect_left(self.trade_times,date_begin):bisect_left(self.trade_times,date_end)]
+        return {'data': {'ethereum': {'dexTrades': dex_trades}}}
+
+    def query_flipside(self,path):
+        return self.pool_stats[int(path.rsplit('/',1)[1])]
+
+    #####################################
+    # Run the http server in a background thread
+    #####################################
+
+    def start(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def respond(self,payload):
+                time.sleep(replay.latency)
+                data = json.dumps(payload,default=str).encode()
+                self.send_response(200)
+                self.send_header('Content-Type','application/json')
+                self.send_header('Content-Length',str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if self.path.startswith('/subgraph'):
+                    self.respond(replay.query_subgraph(body))
+                elif self.path.startswith('/bitquery'):
+                    self.respond(replay.query_bitquery(body))
+                else:
+                    self.send_error(404)
+
+            def do_GET(self):
+                if self.path.startswith('/flipside/'):
+                    self.respond(replay.query_flipside(self.path))
+                else:
+                    self.send_error(404)
+
+            def log_message(self,format,*args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host,self.port),Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve cached pool data as a local stand-in for the remote APIs')
+    parser.add_argument('file_name')
+    parser.add_argument('--port',type=int,default=8000)
+    parser.add_argument('--latency',type=float,default=0.0)
+    parser.add_argument('--page_size',type=int,default=1000)
+    args   = parser.parse_args()
+    server = ReplayServer(args.file_name,latency=args.latency,page_size=args.page_size,port=args.port).start()
+    print('Serving '+args.file_name+' at '+server.url)
+    server.thread.join()
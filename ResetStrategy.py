@@ -3,8 +3,12 @@ import numpy as np
 import math
 from statsmodels.distributions.empirical_distribution import ECDF, monotone_fn_inverter
 import UNI_v3_funcs
+import ActiveStrategyFramework
 
-class ResetStrategy:
+class ResetStrategy(ActiveStrategyFramework.Strategy):
+    
+    RANGE_NAMES = ('base','limit')
+    
     def __init__(self,model_data,alpha_param,tau_param,limit_parameter):
     
         self.alpha_param            = alpha_param
@@ -15,59 +19,37 @@ class ResetStrategy:
         self.inverse_ecdf            = monotone_fn_inverter(ecdf,np.linspace(model_data['price_return'].min(),model_data['price_return'].max(),1000),vectorized=False)
         
     #####################################
-    # Check if a rebalance is necessary. 
-    # If it is, remove the liquidity and set new ranges
+    # Check which prices/states require a rebalance
+    #
+    # This strategy rebalances in two scenarios:
+    # 1. Leave Reset Range
+    # 2. Limit position is too unbalanced (limit_parameter)
+    #    Only checked when the position amounts are part of the state
     #####################################
         
-    def check_strategy(self,current_strat_obs,strategy_info):
+    def check_reset_batch(self,prices,strategy_state):
         
-        #####################################
-        #
-        # This strategy rebalances in three scenarios:
-        # 1. Leave Reset Range
-        # 2. Limit position is too unbalanced (limit_parameter)
-        # 3. Volatility has dropped           (volatility_reset_ratio)
-        #
-        #####################################
+        LEFT_RANGE          = (prices < strategy_state['reset_range_lower']) | (prices > strategy_state['reset_range_upper'])
         
-        LEFT_RANGE_LOW      = current_strat_obs.price < strategy_info['reset_range_lower']
-        LEFT_RANGE_HIGH     = current_strat_obs.price > strategy_info['reset_range_upper']
-        LIMIT_ORDER_BALANCE = current_strat_obs.liquidity_ranges[1]['token_0'] + current_strat_obs.liquidity_ranges[1]['token_1']*current_strat_obs.price
-        BASE_ORDER_BALANCE  = current_strat_obs.liquidity_ranges[0]['token_0'] + current_strat_obs.liquidity_ranges[0]['token_1']*current_strat_obs.price
-        model_forecast      = None
+        if 'token_0' not in strategy_state:
+            return {'exited_range' : LEFT_RANGE}
         
-        # Rebalance out of limit when have both tokens in self.limit_parameter ratio
-        if current_strat_obs.liquidity_ranges[1]['token_0'] > 0.0 and current_strat_obs.liquidity_ranges[1]['token_1'] > 0.0:
-            LIMIT_SIMILAR = ((current_strat_obs.liquidity_ranges[1]['token_0']/current_strat_obs.liquidity_ranges[1]['token_1']) >= self.limit_parameter) | \
-                            ((current_strat_obs.liquidity_ranges[1]['token_0']/current_strat_obs.liquidity_ranges[1]['token_1']) <= (self.limit_parameter+1))
-            if BASE_ORDER_BALANCE > 0.0:
-                LIMIT_REBALANCE = ((LIMIT_ORDER_BALANCE/BASE_ORDER_BALANCE) > (1+self.limit_parameter)) & LIMIT_SIMILAR
-            else:
-                LIMIT_REBALANCE = LIMIT_SIMILAR
-        else:
-            LIMIT_REBALANCE = False
-            
+        LIMIT_TOKEN_0       = np.asarray(strategy_state['token_0'])[...,1]
+        LIMIT_TOKEN_1       = np.asarray(strategy_state['token_1'])[...,1]
+        LIMIT_ORDER_BALANCE = LIMIT_TOKEN_0 + LIMIT_TOKEN_1*prices
+        BASE_ORDER_BALANCE  = np.asarray(strategy_state['token_0'])[...,0] + np.asarray(strategy_state['token_1'])[...,0]*prices
         
-
-        # if a reset is necessary
-        if ((LEFT_RANGE_LOW | LEFT_RANGE_HIGH) | LIMIT_REBALANCE):
-            current_strat_obs.reset_point = True
-            
-            if (LEFT_RANGE_LOW | LEFT_RANGE_HIGH):
-                current_strat_obs.reset_reason = 'exited_range'
-            elif LIMIT_REBALANCE:
-                current_strat_obs.reset_reason = 'limit_imbalance'
-            
-            # Remove liquidity and claim fees 
-            current_strat_obs.remove_liquidity()
-            
-            # Reset liquidity            
-            # TODO: Clean up returns
-            liq_range,strategy_info = self.set_liquidity_ranges(current_strat_obs)
-            return liq_range,strategy_info        
-        else:
-            return current_strat_obs.liquidity_ranges,strategy_info
-            
+        # Rebalance out of limit when have both tokens in self.limit_parameter ratio
+        with np.errstate(divide='ignore',invalid='ignore'):
+            LIMIT_SIMILAR   = ((LIMIT_TOKEN_0/LIMIT_TOKEN_1) >= self.limit_parameter) | \
+                              ((LIMIT_TOKEN_0/LIMIT_TOKEN_1) <= (self.limit_parameter+1))
+            LIMIT_REBALANCE = np.where(BASE_ORDER_BALANCE > 0.0,
+                                       ((LIMIT_ORDER_BALANCE/BASE_ORDER_BALANCE) > (1+self.limit_parameter)) & LIMIT_SIMILAR,
+                                       LIMIT_SIMILAR)
+        LIMIT_REBALANCE     = LIMIT_REBALANCE & (LIMIT_TOKEN_0 > 0.0) & (LIMIT_TOKEN_1 > 0.0)
+        
+        return {'exited_range'    : LEFT_RANGE,
+                'limit_imbalance' : LIMIT_REBALANCE}
             
     def set_liquidity_ranges(self,current_strat_obs):
         
@@ -102,6 +84,12 @@ class ResetStrategy:
         TICK_B_PRE        = int(math.log(current_strat_obs.decimal_adjustment*base_range_upper,1.0001))
         TICK_B            = int(round(TICK_B_PRE/current_strat_obs.tickSpacing)*current_strat_obs.tickSpacing)
         
+        # Pay for minting base and limit positions, and swap towards the base range ratio (if a cost model is used)
+        current_strat_obs.pay_gas(n_mint=2)
+        current_strat_obs.swap_to_ratio(TICK_A,TICK_B)
+        total_token_0_amount = current_strat_obs.liquidity_in_0
+        total_token_1_amount = current_strat_obs.liquidity_in_1
+        
         liquidity_placed_base         = int(UNI_v3_funcs.get_liquidity(current_strat_obs.price_tick,TICK_A,TICK_B,current_strat_obs.liquidity_in_0, \
                                                                        current_strat_obs.liquidity_in_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1))
         
@@ -187,56 +175,75 @@ class ResetStrategy:
         current_strat_obs.liquidity_in_1 = 0.0
         
         return save_ranges,strategy_info
+
+    #####################################
+    # Array version of set_liquidity_ranges for many paths at once (MonteCarlo.ObservationBatch)
+    # The range multipliers only depend on the parameters, so the inverse ECDF is evaluated once
+    #####################################
+    
+    def set_liquidity_ranges_batch(self,batch_obs):
         
+        def price_to_tick(range_price):
+            return ActiveStrategyFramework.price_to_tick(range_price,batch_obs.decimals_0,batch_obs.decimals_1,batch_obs.tickSpacing)
         
-    ########################################################
-    # Extract strategy parameters
-    ########################################################
-    def dict_components(self,strategy_observation):
-            this_data = dict()
-            
-            # General variables
-            this_data['time']                   = strategy_observation.time
-            this_data['price']                  = strategy_observation.price
-            this_data['price_1_0']              = 1/this_data['price']
-            this_data['reset_point']            = strategy_observation.reset_point
-            this_data['reset_reason']           = strategy_observation.reset_reason
-            
-            # Range Variables
-            this_data['base_range_lower']       = strategy_observation.liquidity_ranges[0]['lower_bin_price']
-            this_data['base_range_upper']       = strategy_observation.liquidity_ranges[0]['upper_bin_price']
-            this_data['limit_range_lower']      = strategy_observation.liquidity_ranges[1]['lower_bin_price']
-            this_data['limit_range_upper']      = strategy_observation.liquidity_ranges[1]['upper_bin_price']
-            this_data['reset_range_lower']      = strategy_observation.strategy_info['reset_range_lower']
-            this_data['reset_range_upper']      = strategy_observation.strategy_info['reset_range_upper']
-            
-            # Fee Varaibles
-            this_data['token_0_fees']           = strategy_observation.token_0_fees 
-            this_data['token_1_fees']           = strategy_observation.token_1_fees 
-            this_data['token_0_fees_accum']     = strategy_observation.token_0_fees_accum
-            this_data['token_1_fees_accum']     = strategy_observation.token_1_fees_accum
-            
-            # Asset Variables
-            this_data['token_0_left_over']      = strategy_observation.token_0_left_over
-            this_data['token_1_left_over']      = strategy_observation.token_1_left_over
-            
-            total_token_0 = 0.0
-            total_token_1 = 0.0
-            for i in range(len(strategy_observation.liquidity_ranges)):
-                total_token_0 += strategy_observation.liquidity_ranges[i]['token_0']
-                total_token_1 += strategy_observation.liquidity_ranges[i]['token_1']
-                
-            this_data['token_0_allocated']      = total_token_0
-            this_data['token_1_allocated']      = total_token_1
-            this_data['token_0_total']          = total_token_0 + strategy_observation.token_0_left_over + strategy_observation.token_0_fees_accum
-            this_data['token_1_total']          = total_token_1 + strategy_observation.token_1_left_over + strategy_observation.token_1_fees_accum
-
-            # Value Variables
-            this_data['value_position']         = this_data['token_0_total'] + this_data['token_1_total'] * this_data['price_1_0']
-            this_data['value_allocated']        = this_data['token_0_allocated'] + this_data['token_1_allocated'] * this_data['price_1_0']
-            this_data['value_left_over']        = this_data['token_0_left_over'] + this_data['token_1_left_over'] * this_data['price_1_0']
-            
-            this_data['base_position_value']    = strategy_observation.liquidity_ranges[0]['token_0'] + strategy_observation.liquidity_ranges[0]['token_1'] * this_data['price_1_0']
-            this_data['limit_position_value']   = strategy_observation.liquidity_ranges[1]['token_0'] + strategy_observation.liquidity_ranges[1]['token_1'] * this_data['price_1_0']
-             
-            return this_data
\ No newline at end of file
+        strategy_info = dict()
+        strategy_info['reset_range_lower']     = (1 + self.inverse_ecdf((1 -      self.tau_param)/2))    * batch_obs.price
+        strategy_info['reset_range_upper']     = (1 + self.inverse_ecdf( 1 - (1 - self.tau_param)/2))    * batch_obs.price
+        
+        base_range_lower      = (1 + self.inverse_ecdf((1 -      self.alpha_param)/2))  * batch_obs.price
+        base_range_upper      = (1 + self.inverse_ecdf( 1 - (1 - self.alpha_param)/2))  * batch_obs.price
+        
+        # Set Base Liquidity
+        TICK_A                = price_to_tick(base_range_lower)
+        TICK_B                = price_to_tick(base_range_upper)
+        
+        batch_obs.pay_gas(n_mint=2)
+        batch_obs.swap_to_ratio(TICK_A,TICK_B)
+        
+        liquidity_placed_base         = UNI_v3_funcs.get_liquidity_array(batch_obs.price_tick,TICK_A,TICK_B,batch_obs.liquidity_in_0,
+                                                                         batch_obs.liquidity_in_1,batch_obs.decimals_0,batch_obs.decimals_1)
+        base_0_amount,base_1_amount   = UNI_v3_funcs.get_amounts_array(batch_obs.price_tick,TICK_A,TICK_B,liquidity_placed_base,
+                                                                       batch_obs.decimals_0,batch_obs.decimals_1)
+        
+        total_token_0_amount  = batch_obs.liquidity_in_0 - base_0_amount
+        total_token_1_amount  = batch_obs.liquidity_in_1 - base_1_amount
+        
+        # Set Limit Position, placing the single sided highest value
+        PLACE_TOKEN_0         = total_token_0_amount*batch_obs.price > total_token_1_amount
+        limit_amount_0        = np.where(PLACE_TOKEN_0,total_token_0_amount,0.0)
+        limit_amount_1        = np.where(PLACE_TOKEN_0,0.0,total_token_1_amount)
+        limit_range_lower     = np.where(PLACE_TOKEN_0,batch_obs.price,base_range_lower)
+        limit_range_upper     = np.where(PLACE_TOKEN_0,base_range_upper,batch_obs.price)
+        
+        TICK_A_LIMIT          = price_to_tick(limit_range_lower)
+        TICK_B_LIMIT          = price_to_tick(limit_range_upper)
+        
+        liquidity_placed_limit        = UNI_v3_funcs.get_liquidity_array(batch_obs.price_tick,TICK_A_LIMIT,TICK_B_LIMIT,limit_amount_0,
+                                                                         limit_amount_1,batch_obs.decimals_0,batch_obs.decimals_1)
+        limit_0_amount,limit_1_amount = UNI_v3_funcs.get_amounts_array(batch_obs.price_tick,TICK_A_LIMIT,TICK_B_LIMIT,liquidity_placed_limit,
+                                                                       batch_obs.decimals_0,batch_obs.decimals_1)
+        
+        save_ranges = [{'lower_bin_tick'     : TICK_A,
+                        'upper_bin_tick'     : TICK_B,
+                        'lower_bin_price'    : base_range_lower,
+                        'upper_bin_price'    : base_range_upper,
+                        'token_0'            : base_0_amount,
+                        'token_1'            : base_1_amount,
+                        'position_liquidity' : liquidity_placed_base},
+                       {'lower_bin_tick'     : TICK_A_LIMIT,
+                        'upper_bin_tick'     : TICK_B_LIMIT,
+                        'lower_bin_price'    : limit_range_lower,
+                        'upper_bin_price'    : limit_range_upper,
+                        'token_0'            : limit_0_amount,
+                        'token_1'            : limit_1_amount,
+                        'position_liquidity' : liquidity_placed_limit}]
+        
+        # How much liquidity is not allcated to ranges
+        batch_obs.token_0_left_over = np.maximum(total_token_0_amount - limit_0_amount,0.0)
+        batch_obs.token_1_left_over = np.maximum(total_token_1_amount - limit_1_amount,0.0)
+        
+        # Since liquidity was allocated, set to 0
+        batch_obs.liquidity_in_0    = np.zeros_like(batch_obs.liquidity_in_0)
+        batch_obs.liquidity_in_1    = np.zeros_like(batch_obs.liquidity_in_1)
+        
+        return save_ranges,strategy_info
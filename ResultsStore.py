@@ -0,0 +1,115 @@
+import os
+import hashlib
+import sqlite3
+import pandas as pd
+import numpy as np
+
+########################################################
+# Append-only store for sweep outputs
+#   <path>/shared/<key>.parquet        : time, price, price_1_0 of a price path, stored once
+#   <path>/series/run_id=<id>.parquet  : the other generate_simulation_series columns of a run (zstd)
+#   <path>/summaries.sqlite            : one row per run with its parameters and analyze_strategy summary
+# Summaries are queried with SQL, e.g. the top 20 runs by net_apr with fewer than 50 rebalances:
+#   store.query(where='rebalances < 50',order_by='net_apr',limit=20)
+# and a run's series is only read from disk when asked for, e.g. for plot_strategy:
+#   ActiveStrategyFramework.plot_strategy(store.load_series(run_id),'Price')
+# Requires pyarrow for the parquet files.
+########################################################
+
+SHARED_COLUMNS  = ['time','price','price_1_0']
+# Summary columns indexed when the store is opened, more can be added with create_index
+INDEXED_COLUMNS = ['net_apr','rebalances']
+
+class ResultsStore:
+    def __init__(self,path):
+
+        self.path       = path
+        os.makedirs(os.path.join(path,'shared'),exist_ok=True)
+        os.makedirs(os.path.join(path,'series'),exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(path,'summaries.sqlite'))
+        self.connection.execute('CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, shared_key TEXT)')
+        for column in INDEXED_COLUMNS:
+            self.create_index(column)
+
+    #####################################
+    # Add a run: data_strategy from generate_simulation_series, summary from analyze_strategy
+    # and params any strategy parameters to query by. Returns the run_id
+    #####################################
+
+    def add_run(self,data_strategy,summary,params=None):
+
+        shared_key  = self.write_shared(data_strategy[SHARED_COLUMNS])
+
+        # Summary row, adding columns for keys not seen before
+        row         = {**(params or dict()),**summary,'shared_key': shared_key}
+        row         = {key: (value.item() if isinstance(value,np.generic) else value) for key,value in row.items()}
+        self.add_columns(row.keys())
+
+        # The row is only committed once its series is on disk, a failed write rolls it back
+        series      = data_strategy.drop(columns=SHARED_COLUMNS).reset_index(drop=True)
+        file_name   = None
+        try:
+            cursor    = self.connection.execute('INSERT INTO runs ('+','.join('"'+x+'"' for x in row)+') VALUES ('+','.join('?'*len(row))+')',
+                                                list(row.values()))
+            run_id    = cursor.lastrowid
+            file_name = os.path.join(self.path,'series','run_id='+str(run_id)+'.parquet')
+            series.to_parquet(file_name+'.tmp',compression='zstd',index=False)
+            os.replace(file_name+'.tmp',file_name)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            if file_name is not None and os.path.exists(file_name+'.tmp'):
+                os.remove(file_name+'.tmp')
+            raise
+
+        return run_id
+
+    def write_shared(self,shared_data):
+        # Runs over the same price path share one file, keyed by a hash of its times and prices
+        time_values = pd.DatetimeIndex(shared_data['time']).asi8
+        shared_key  = hashlib.sha1(time_values.tobytes() + shared_data['price'].to_numpy(dtype=float).tobytes()).hexdigest()[:16]
+        file_name   = os.path.join(self.path,'shared',shared_key+'.parquet')
+        if not os.path.exists(file_name):
+            shared_data.reset_index(drop=True).to_parquet(file_name+'.tmp',index=False)
+            os.replace(file_name+'.tmp',file_name)
+        return shared_key
+
+    def add_columns(self,keys):
+        columns = [x[1] for x in self.connection.execute('PRAGMA table_info(runs)')]
+        for key in keys:
+            if key not in columns:
+                self.connection.execute('ALTER TABLE runs ADD COLUMN "'+key+'"')
+
+    #####################################
+    # Queries on the summary table
+    #####################################
+
+    def create_index(self,column):
+        self.add_columns([column])
+        self.connection.execute('CREATE INDEX IF NOT EXISTS "idx_'+column+'" ON runs ("'+column+'")')
+        self.connection.commit()
+
+    def query(self,where=None,order_by=None,ascending=False,limit=None):
+        sql = 'SELECT * FROM runs'
+        if where is not None:
+            sql += ' WHERE '+where
+        if order_by is not None:
+            sql += ' ORDER BY "'+order_by+'" '+('ASC' if ascending else 'DESC')
+        if limit is not None:
+            sql += ' LIMIT '+str(int(limit))
+        return pd.read_sql_query(sql,self.connection).set_index('run_id')
+
+    #####################################
+    # Series of a run in the generate_simulation_series format
+    #####################################
+
+    def load_series(self,run_id,columns=None):
+        shared_key = self.connection.execute('SELECT shared_key FROM runs WHERE run_id = ?',(int(run_id),)).fetchone()[0]
+        shared     = pd.read_parquet(os.path.join(self.path,'shared',shared_key+'.parquet'))
+        series     = pd.read_parquet(os.path.join(self.path,'series','run_id='+str(int(run_id))+'.parquet'),columns=columns)
+        data       = pd.concat([shared,series],axis=1)
+        data       = data.set_index('time',drop=False)
+        return data
+
+    def close(self):
+        self.connection.close()
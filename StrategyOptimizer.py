@@ -0,0 +1,90 @@
+import pandas as pd
+import numpy as np
+import ActiveStrategyFramework
+import ResetStrategy
+from concurrent.futures import ProcessPoolExecutor
+
+########################################################
+# Strategy parameter search by successive halving
+# Every candidate is first simulated on a short prefix of price_data, only the best
+# 1/eta of them are promoted to a prefix eta times longer, until the survivors run on
+# the full history. Candidates are scored with an analyze_strategy metric (net_apr by default),
+# maximized unless maximize=False (e.g. for max_drawdown or volatility),
+# and each rung is evaluated in parallel across n_workers processes.
+########################################################
+
+def sample_candidates(param_ranges,n_candidates,seed=None):
+    # param_ranges: dict of parameter name : (low, high), sampled uniformly
+    rng = np.random.default_rng(seed)
+    return [{name: rng.uniform(low,high) for name,(low,high) in param_ranges.items()} for i in range(n_candidates)]
+
+def successive_halving(price_data,swap_data,candidates,model_data,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                       strategy_class=ResetStrategy.ResetStrategy,metric='net_apr',maximize=True,eta=3,min_steps=None,n_workers=None,
+                       simulation_args=None):
+
+    simulation_args = simulation_args or dict()
+    n_steps_full    = len(price_data)
+    n_rungs         = max(int(np.floor(np.log(len(candidates))/np.log(eta))),0)
+    # analyze_strategy needs at least a day of history
+    one_day_steps   = int(np.searchsorted(price_data.index,price_data.index[0] + pd.Timedelta(days=1))) + 1
+    n_steps         = max(min_steps or int(n_steps_full/eta**n_rungs),one_day_steps)
+
+    survivors       = list(range(len(candidates)))
+    results         = []
+    total_steps     = 0
+
+    with ProcessPoolExecutor(n_workers) as executor:
+        while True:
+            n_steps  = min(n_steps,n_steps_full)
+            # Only ship the swaps of the prefix to the workers
+            prefix   = price_data.iloc[:n_steps]
+            swaps    = swap_data[prefix.index[0]:prefix.index[-1]]
+            jobs     = [executor.submit(evaluate_candidate,prefix,swaps,candidates[i],model_data,
+                                        liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,strategy_class,simulation_args)
+                        for i in survivors]
+            scores   = [job.result() for job in jobs]
+
+            for i,summary in zip(survivors,scores):
+                results.append({**candidates[i],**summary,'candidate': i,'n_steps': n_steps})
+            total_steps += n_steps*len(survivors)
+
+            if n_steps >= n_steps_full:
+                break
+
+            # Promote the best 1/eta to a longer prefix, failed candidates (NaN) last
+            sign      = -1.0 if maximize else 1.0
+            ranking   = np.argsort([np.nan_to_num(sign*x.get(metric,np.nan),nan=np.inf) for x in scores],kind='stable')
+            survivors = [survivors[j] for j in ranking[:max(int(len(survivors)/eta),1)]]
+            n_steps   = n_steps*eta if len(survivors) > 1 else n_steps_full
+
+    results = pd.DataFrame(results)
+    results.attrs['total_steps'] = total_steps
+
+    # Rank candidates by their metric on the longest prefix they reached
+    best    = results.sort_values('n_steps').groupby('candidate').tail(1)
+    return best.sort_values(['n_steps',metric],ascending=[False,not maximize],na_position='last').reset_index(drop=True),results
+
+########################################################
+# Simulate one candidate and summarize it with analyze_strategy
+########################################################
+
+def evaluate_candidate(price_data,swap_data,params,model_data,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                       strategy_class=ResetStrategy.ResetStrategy,simulation_args=None):
+
+    strategy_in    = strategy_class(model_data,**params)
+    
+    # Degenerate parameters (e.g. ranges narrower than a tick) fail in the liquidity math
+    try:
+        simulations = ActiveStrategyFramework.simulate_strategy(price_data,swap_data,strategy_in,
+                                                                liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                                                                **(simulation_args or dict()))
+    except ZeroDivisionError:
+        return {'net_apr': np.nan}
+        
+    data_strategy  = ActiveStrategyFramework.generate_simulation_series(simulations,strategy_in)
+    initial_value  = liquidity_in_0 + liquidity_in_1/price_data[0]
+
+    if (data_strategy['time'].max() - data_strategy['time'].min()).days == 0:
+        return {'net_apr': np.nan}
+
+    return ActiveStrategyFramework.analyze_strategy(data_strategy,initial_value)
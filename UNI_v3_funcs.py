@@ -6,6 +6,7 @@ Created on Mon Jun 14 18:53:09 2021
 """
 
 
+import numpy as np
 
 '''liquitidymath'''
 '''Python library to emulate the calculations done in liquiditymath.sol of UNI_V3 peryphery contract'''
@@ -57,6 +58,22 @@ def get_amounts(tick,tickA,tickB,liquidity,decimal0,decimal1):
         amount1=get_amount1(sqrtA,sqrtB,liquidity,decimal1)
         return 0,amount1
 
+'''get_amounts_array function'''
+#Float version of 'get_amounts' that works on numpy arrays of ticks, ranges and liquidity (e.g. many simulated paths at once)
+def get_amounts_array(tick,tickA,tickB,liquidity,decimal0,decimal1):
+
+    sqrt  = 1.0001**(np.asarray(tick)/2)
+    sqrtA = 1.0001**(np.minimum(tickA,tickB)/2)
+    sqrtB = 1.0001**(np.maximum(tickA,tickB)/2)
+
+    # Below the range only token 0 is held, above it only token 1
+    sqrt  = np.clip(sqrt,sqrtA,sqrtB)
+
+    amount0 = liquidity*(1/sqrt-1/sqrtB)/10**decimal0
+    amount1 = liquidity*(sqrt-sqrtA)/10**decimal1
+
+    return amount0,amount1
+
 '''get token amounts relation'''
 #Use this formula to calculate amount of t0 based on amount of t1 (required before calculate liquidity)
 #relation = t1/t0      
@@ -116,6 +133,25 @@ def get_liquidity(tick,tickA,tickB,amount0,amount1,decimal0,decimal1):
             liquidity1 = get_liquidity1(sqrtA,sqrtB,amount1,decimal1)
             return liquidity1
 
+'''get_liquidity_array function'''
+#Float version of 'get_liquidity' that works on numpy arrays of ticks, ranges and amounts (e.g. many simulated paths at once)
+#A zero width range gets no liquidity
+def get_liquidity_array(tick,tickA,tickB,amount0,amount1,decimal0,decimal1):
+
+    sqrt  = 1.0001**(np.asarray(tick)/2)
+    sqrtA = 1.0001**(np.minimum(tickA,tickB)/2)
+    sqrtB = 1.0001**(np.maximum(tickA,tickB)/2)
+
+    # Below the range only token 0 limits the liquidity, above it only token 1
+    sqrt  = np.clip(sqrt,sqrtA,sqrtB)
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        liquidity0 = np.where(sqrtB > sqrt,amount0*10**decimal0/(1/sqrt-1/sqrtB),np.inf)
+        liquidity1 = np.where(sqrt > sqrtA,amount1*10**decimal1/(sqrt-sqrtA),np.inf)
+
+    liquidity = np.minimum(liquidity0,liquidity1)
+    return np.where(np.isinf(liquidity),0.0,liquidity)
+
 
         
 